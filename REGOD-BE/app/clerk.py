@@ -1,11 +1,22 @@
-import requests
-from fastapi import HTTPException, status
-from typing import Optional
+import asyncio
+import base64
+import binascii
+import hashlib
+import httpx
+from collections import OrderedDict
+from fastapi import Header, HTTPException, Request, status
+from typing import List, Optional
 import os
+import logging
+import time
 from dotenv import load_dotenv
 
+from app.utils.security import hmac_sha256_verifier
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class ClerkAuth:
     def __init__(self, api_key: str = None, api_url: str = "https://api.clerk.dev/v1"):
         self.api_key = api_key or os.getenv("CLERK_API_KEY")
@@ -24,14 +35,26 @@ class ClerkAuth:
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        # Headers as they appear in debug logs, with the API key redacted
+        self._log_headers = {**self.headers, "Authorization": "Bearer [REDACTED]"}
+        # One pooled HTTP/2 client for every Clerk call, so requests reuse
+        # the same TLS session instead of handshaking per call
+        self._client = httpx.AsyncClient(
+            base_url=self.api_url,
+            headers=self.headers,
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            timeout=10.0
+        )
+
+    async def aclose(self):
+        """Close the pooled HTTP client (called on application shutdown)"""
+        await self._client.aclose()
     
-    def get_user(self, user_id: str) -> Optional[dict]:
+    async def get_user(self, user_id: str) -> Optional[dict]:
         """Get user details from Clerk"""
         try:
-            response = requests.get(
-                f"{self.api_url}/users/{user_id}",
-                headers=self.headers
-            )
+            response = await self._client.get(f"/users/{user_id}")
             if response.status_code == 200:
                 return response.json()
             return None
@@ -41,20 +64,10 @@ class ClerkAuth:
                 detail=f"Error fetching user from Clerk: {str(e)}"
             )
     
-    def verify_webhook_signature(self, payload: str, signature: str, secret: str) -> bool:
-        """Verify Clerk webhook signature"""
-        # Implementation would use cryptography library to verify the signature
-        # For now, we'll assume this is implemented
-        return True
-    
-    def create_user(self, user_data: dict) -> Optional[dict]:
+    async def create_user(self, user_data: dict) -> Optional[dict]:
         """Create a user in Clerk"""
         try:
-            response = requests.post(
-                f"{self.api_url}/users",
-                headers=self.headers,
-                json=user_data
-            )
+            response = await self._client.post("/users", json=user_data)
             if response.status_code == 200:
                 return response.json()
             return None
@@ -64,25 +77,19 @@ class ClerkAuth:
                 detail=f"Error creating user in Clerk: {str(e)}"
             )
 
-    def create_invitation(self, email_address: str, redirect_url: str | None = None) -> Optional[dict]:
+    async def create_invitation(self, email_address: str, redirect_url: str | None = None) -> Optional[dict]:
         """Create an invitation in Clerk (sends email with signup link)."""
         try:
             payload = {"email_address": email_address}
             if redirect_url:
                 payload["redirect_url"] = redirect_url
             
-            print(f"Sending Clerk invitation request to: {self.api_url}/invitations")
-            print(f"Payload: {payload}")
-            print(f"Headers: {self.headers}")
+            logger.debug("Sending Clerk invitation request to %s/invitations payload=%s headers=%s",
+                         self.api_url, payload, self._log_headers)
             
-            response = requests.post(
-                f"{self.api_url}/invitations",
-                headers=self.headers,
-                json=payload,
-            )
+            response = await self._client.post("/invitations", json=payload)
             
-            print(f"Clerk API response status: {response.status_code}")
-            print(f"Clerk API response text: {response.text}")
+            logger.debug("Clerk API response status=%s text=%s", response.status_code, response.text)
             
             if response.status_code in (200, 201):
                 return response.json()
@@ -93,7 +100,7 @@ class ClerkAuth:
             except Exception:
                 err = {"error": response.text}
             
-            print(f"Clerk API error: {err}")
+            logger.warning("Clerk invitation failed for %s: %s", email_address, err)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Clerk invitation failed: {err}"
@@ -101,11 +108,95 @@ class ClerkAuth:
         except HTTPException:
             raise
         except Exception as e:
-            print(f"Exception in create_invitation: {str(e)}")
+            logger.error("Exception in create_invitation: %s", e)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Error creating Clerk invitation: {str(e)}"
             )
 
+    async def create_invitations(self, emails: List[str], redirect_url: str | None = None) -> list:
+        """Create Clerk invitations for several emails concurrently.
+
+        Requests are multiplexed over the shared HTTP/2 client. Results are
+        returned in input order; a failed invitation appears as its exception.
+        """
+        return await asyncio.gather(
+            *(self.create_invitation(email, redirect_url) for email in emails),
+            return_exceptions=True
+        )
+
 # Initialize Clerk client
-clerk_client = ClerkAuth()
\ No newline at end of file
+clerk_client = ClerkAuth()
+
+
+# Clerk webhook settings. Clerk (Svix) secrets are "whsec_" + base64 key bytes.
+CLERK_WEBHOOK_SECRET = os.getenv("CLERK_WEBHOOK_SECRET") or ""
+SECRET = (
+    base64.b64decode(CLERK_WEBHOOK_SECRET[len("whsec_"):])
+    if CLERK_WEBHOOK_SECRET.startswith("whsec_")
+    else CLERK_WEBHOOK_SECRET.encode()
+)
+if not SECRET:
+    logger.warning("CLERK_WEBHOOK_SECRET is not set; every Clerk webhook will be rejected")
+_verify_signature = hmac_sha256_verifier(SECRET)
+
+# Svix rejects deliveries whose timestamp is this far from now, so a captured
+# signed request cannot be replayed later
+WEBHOOK_TOLERANCE_SECONDS = 5 * 60
+
+# Svix retries the same delivery (same svix-id, signature and body) until it
+# gets a 2xx, so remember recent verification results instead of re-hashing.
+VERIFY_CACHE_SIZE = 4096
+_verify_cache: "OrderedDict[tuple, bool]" = OrderedDict()
+
+
+def _verify_svix(svix_id: str, timestamp: str, signature: str, body: bytes) -> bool:
+    """Check a svix-signature header ("v1,<base64> v1,<base64> ...") against the body."""
+    signed_content = f"{svix_id}.{timestamp}.".encode() + body
+    for entry in signature.split():
+        version, _, sig = entry.partition(",")
+        if version != "v1":
+            continue
+        try:
+            if _verify_signature(signed_content, base64.b64decode(sig)):
+                return True
+        except binascii.Error:
+            continue
+    return False
+
+
+def _verify_cached(svix_id: str, timestamp: str, signature: str, body: bytes) -> bool:
+    """Verify a webhook signature, reusing the result for retried deliveries."""
+    # A 128-bit BLAKE2b of the body keeps the key small while still binding
+    # the cached result to the exact payload that was signed.
+    key = (svix_id, timestamp, signature, hashlib.blake2b(body, digest_size=16).digest())
+    result = _verify_cache.get(key)
+    if result is not None:
+        _verify_cache.move_to_end(key)
+        return result
+
+    result = _verify_svix(svix_id, timestamp, signature, body)
+    _verify_cache[key] = result
+    if len(_verify_cache) > VERIFY_CACHE_SIZE:
+        _verify_cache.popitem(last=False)
+    return result
+
+
+async def verified_body(
+    request: Request,
+    svix_id: str = Header(...),
+    svix_timestamp: str = Header(...),
+    svix_signature: str = Header(...),
+) -> bytes:
+    """Dependency returning the raw webhook body once its Svix signature checks out."""
+    try:
+        timestamp = int(svix_timestamp)
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Invalid webhook timestamp")
+    if abs(time.time() - timestamp) > WEBHOOK_TOLERANCE_SECONDS:
+        raise HTTPException(status_code=401, detail="Webhook timestamp outside tolerance")
+
+    body = await request.body()
+    if not _verify_cached(svix_id, svix_timestamp, svix_signature, body):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    return body
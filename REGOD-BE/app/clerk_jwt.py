@@ -4,72 +4,125 @@ Handles JWT token verification using Clerk's JWKS endpoint
 """
 
 import jwt
-import requests
+import httpx
+import asyncio
 import os
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, Optional, Tuple
 from fastapi import HTTPException
 import logging
+import base64
+from functools import lru_cache
+from cryptography.hazmat.primitives.asymmetric import rsa
 
 logger = logging.getLogger(__name__)
 
+JWKS_TTL = 3600  # Cache JWKS for 1 hour
+JWKS_REFRESH_MARGIN = 60  # Refresh this many seconds before expiry
+VERIFIED_CACHE_SIZE = 10000
+VERIFIED_MAX_TTL = 300  # Cap cached token lifetime to bound clock skew
+
+def _b64u(s: str) -> bytes:
+    """Decode unpadded base64url (as used in JWKs), adding only the padding needed"""
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+# Verified token -> (payload, expires_at); the event loop is single-threaded so no lock
+_verified: Dict[str, tuple] = {}
+
 class ClerkJWKS:
+    # Clerk publishes only a handful of keys, so kids and keys are kept as
+    # parallel tuples and scanned linearly rather than hashed.
+    __slots__ = ("jwks_url", "_kids", "_keys", "_cache_expiry", "_etag", "_lock", "_refresh_task", "_client")
+
     def __init__(self):
         self.jwks_url = os.getenv("CLERK_JWKS_URL", "https://divine-urchin-82.clerk.accounts.dev/.well-known/jwks.json")
-        self._jwks_cache = None
+        self._kids: Tuple[str, ...] = ()
+        self._keys: Tuple[rsa.RSAPublicKey, ...] = ()
         self._cache_expiry = None
-    
-    def get_jwks(self) -> Dict[str, Any]:
-        """Get JWKS from Clerk with caching"""
-        import time
-        
-        # Check if cache is still valid (cache for 1 hour)
-        if (self._jwks_cache and self._cache_expiry and 
-            time.time() < self._cache_expiry):
-            return self._jwks_cache
-        
-        try:
-            response = requests.get(self.jwks_url, timeout=10)
-            response.raise_for_status()
-            self._jwks_cache = response.json()
-            self._cache_expiry = time.time() + 3600  # Cache for 1 hour
-            return self._jwks_cache
-        except Exception as e:
-            logger.error(f"Failed to fetch JWKS: {e}")
-            raise HTTPException(
-                status_code=500,
-                detail={"error": {"code": "JWKS_FETCH_FAILED", "message": "Failed to fetch JWKS"}}
-            )
-    
-    def get_public_key(self, kid: str) -> str:
-        """Get public key for a specific key ID"""
-        jwks = self.get_jwks()
-        
+        self._etag = None
+        self._lock = asyncio.Lock()
+        self._refresh_task = None
+        self._client = httpx.AsyncClient(timeout=10.0)
+
+    async def aclose(self):
+        """Stop the refresh task and close the HTTP client (called on application shutdown)"""
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        await self._client.aclose()
+
+    def start_refresh(self):
+        """Start the background JWKS refresh task (called on application startup)"""
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        """Re-fetch the JWKS shortly before it expires so requests never wait on it"""
+        while True:
+            try:
+                await self._refresh()
+            except Exception as e:
+                logger.error(f"Failed to refresh JWKS: {e}")
+            delay = (self._cache_expiry or 0) - time.time() - JWKS_REFRESH_MARGIN
+            await asyncio.sleep(max(delay, JWKS_REFRESH_MARGIN))
+
+    async def _refresh(self):
+        """Fetch the JWKS, revalidating with If-None-Match when we hold an ETag"""
+        headers = {"If-None-Match": self._etag} if self._etag and self._keys else {}
+        response = await self._client.get(self.jwks_url, headers=headers)
+        if response.status_code == 304:
+            self._cache_expiry = time.time() + JWKS_TTL
+            return
+        response.raise_for_status()
+        self._kids, self._keys = self._build_keys(response.json())
+        self._etag = response.headers.get("etag")
+        self._cache_expiry = time.time() + JWKS_TTL
+
+    @staticmethod
+    def _build_keys(jwks: Dict[str, Any]) -> Tuple[Tuple[str, ...], Tuple[rsa.RSAPublicKey, ...]]:
+        """Materialize each RSA JWK into a public key object, parallel to its kid"""
+        kids, keys = [], []
         for key in jwks.get("keys", []):
-            if key.get("kid") == kid:
-                # Convert JWK to PEM format
-                from cryptography.hazmat.primitives import serialization
-                from cryptography.hazmat.primitives.asymmetric import rsa
-                import base64
-                
-                # Extract RSA parameters
-                n = base64.urlsafe_b64decode(key["n"] + "==")
-                e = base64.urlsafe_b64decode(key["e"] + "==")
-                
-                # Convert to integers
-                n_int = int.from_bytes(n, 'big')
-                e_int = int.from_bytes(e, 'big')
-                
-                # Create RSA public key
-                public_key = rsa.RSAPublicNumbers(e_int, n_int).public_key()
-                
-                # Convert to PEM format
-                pem = public_key.public_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PublicFormat.SubjectPublicKeyInfo
+            if key.get("kty") != "RSA" or "kid" not in key:
+                continue
+            n = int.from_bytes(_b64u(key["n"]), 'big')
+            e = int.from_bytes(_b64u(key["e"]), 'big')
+            kids.append(key["kid"])
+            keys.append(rsa.RSAPublicNumbers(e, n).public_key())
+        return tuple(kids), tuple(keys)
+
+    def _cache_valid(self) -> bool:
+        return bool(self._keys and self._cache_expiry and time.time() < self._cache_expiry)
+
+    async def get_jwks(self) -> Tuple[Tuple[str, ...], Tuple[rsa.RSAPublicKey, ...]]:
+        """Get JWKS public keys from Clerk with caching, as parallel (kids, keys) tuples"""
+        if self._cache_valid():
+            return self._kids, self._keys
+
+        # Only one coroutine fetches on expiry; the rest wait and reuse its result
+        async with self._lock:
+            if self._cache_valid():
+                return self._kids, self._keys
+            try:
+                await self._refresh()
+                return self._kids, self._keys
+            except Exception as e:
+                logger.error(f"Failed to fetch JWKS: {e}")
+                raise HTTPException(
+                    status_code=500,
+                    detail={"error": {"code": "JWKS_FETCH_FAILED", "message": "Failed to fetch JWKS"}}
                 )
-                
-                return pem.decode('utf-8')
-        
+    
+    async def get_public_key(self, kid: str) -> rsa.RSAPublicKey:
+        """Get public key for a specific key ID"""
+        kids, keys = await self.get_jwks()
+        for i, k in enumerate(kids):
+            if k == kid:
+                return keys[i]
         raise HTTPException(
             status_code=401,
             detail={"error": {"code": "INVALID_KEY_ID", "message": "Invalid key ID"}}
@@ -78,8 +131,15 @@ class ClerkJWKS:
 # Global instance
 clerk_jwks = ClerkJWKS()
 
-def verify_clerk_jwt(token: str) -> Dict[str, Any]:
+async def verify_clerk_jwt(token: str) -> Dict[str, Any]:
     """Verify Clerk JWT token and return payload"""
+    now = time.time()
+    cached = _verified.get(token)
+    if cached is not None:
+        if now < cached[1]:
+            return cached[0]
+        del _verified[token]
+
     try:
         # Decode header to get key ID
         header = jwt.get_unverified_header(token)
@@ -92,33 +152,21 @@ def verify_clerk_jwt(token: str) -> Dict[str, Any]:
             )
         
         # Get public key
-        public_key = clerk_jwks.get_public_key(kid)
-        
-        # Verify and decode token - try multiple algorithms
-        algorithms = ["RS256", "HS256", "ES256"]
-        payload = None
+        public_key = await clerk_jwks.get_public_key(kid)
         
-        for alg in algorithms:
-            try:
-                payload = jwt.decode(
-                    token,
-                    public_key,
-                    algorithms=[alg],
-                    options={"verify_exp": True, "verify_aud": False}
-                )
-                break
-            except jwt.InvalidAlgorithmError:
-                continue
-            except Exception as e:
-                if alg == algorithms[-1]:  # Last algorithm
-                    raise e
-                continue
+        # Clerk signs session tokens with RS256 only
+        payload = jwt.decode(
+            token,
+            public_key,
+            algorithms=["RS256"],
+            options={"verify_exp": True, "verify_aud": False}
+        )
         
-        if not payload:
-            raise HTTPException(
-                status_code=401,
-                detail={"error": {"code": "INVALID_ALGORITHM", "message": "Token algorithm not supported"}}
-            )
+        exp = payload.get("exp")
+        if exp:
+            if len(_verified) >= VERIFIED_CACHE_SIZE:
+                del _verified[next(iter(_verified))]
+            _verified[token] = (payload, min(exp, now + VERIFIED_MAX_TTL))
         
         return payload
         
@@ -146,6 +194,28 @@ def verify_clerk_jwt(token: str) -> Dict[str, Any]:
         )
 
 
+@lru_cache(maxsize=1024)
+def _session_payload(head: str) -> Dict[str, Any]:
+    """Build the development payload for a session ID prefix (deterministic per session)"""
+    logger.warning("Using development session verification - configure JWT template in Clerk dashboard for production")
+    logger.warning("JWT Template Configuration: Use these fields: user_id, email, full_name, email_verified")
+
+    # Since we can't decode Clerk session tokens without their API,
+    # we'll use the session ID to create a consistent user ID
+    session_id = head.removeprefix('sess_')
+
+    # Create a consistent user ID from the session
+    # This matches the actual Clerk user ID format
+    return {
+        "sub": f"user_{session_id}",  # Use session ID to create consistent user ID
+        "user_id": f"user_{session_id}",  # Also provide user_id field
+        "email": f"user_{session_id}@example.com",  # Mock email for development
+        "name": "Development User",  # Mock name for development
+        "email_verified": False,  # Mock verification status
+        "session_id": session_id
+    }
+
+
 def verify_clerk_session(token: str) -> Dict[str, Any]:
     """Verify Clerk session token and return user info"""
     try:
@@ -160,38 +230,23 @@ def verify_clerk_session(token: str) -> Dict[str, Any]:
 
         # For development, we'll create a payload that allows the system to work
         # In production, you should use Clerk's session verification API:
-        # response = requests.post(f"https://api.clerk.com/v1/sessions/{token.split('.')[0]}/verify",
+        # response = requests.post(f"https://api.clerk.com/v1/sessions/{token.partition('.')[0]}/verify",
         #                        headers={"Authorization": f"Bearer {CLERK_SECRET_KEY}"})
 
+        head, sep, _ = token.partition('.')
+        if sep:
+            # Copy so callers can't mutate the cached payload
+            return dict(_session_payload(head))
+
         logger.warning("Using development session verification - configure JWT template in Clerk dashboard for production")
-        logger.warning("JWT Template Configuration: Use these fields: user_id, email, full_name, email_verified")
-
-        # For now, return a payload that will work with our system
-        # Since we can't decode Clerk session tokens without their API,
-        # we'll use the session ID to create a consistent user ID
-        session_parts = token.split('.')
-        if len(session_parts) >= 2:
-            session_id = session_parts[0].replace('sess_', '')
-
-            # Create a consistent user ID from the session
-            # This matches the actual Clerk user ID format
-            return {
-                "sub": f"user_{session_id}",  # Use session ID to create consistent user ID
-                "user_id": f"user_{session_id}",  # Also provide user_id field
-                "email": f"user_{session_id}@example.com",  # Mock email for development
-                "name": "Development User",  # Mock name for development
-                "email_verified": False,  # Mock verification status
-                "session_id": session_id
-            }
-        else:
-            # Fallback for tokens without payload
-            return {
-                "sub": "user_dev_session",
-                "user_id": "user_dev_session",
-                "email": "dev@example.com",
-                "name": "Development User",
-                "email_verified": False
-            }
+        # Fallback for tokens without payload
+        return {
+            "sub": "user_dev_session",
+            "user_id": "user_dev_session",
+            "email": "dev@example.com",
+            "name": "Development User",
+            "email_verified": False
+        }
 
     except HTTPException:
         raise
@@ -1,31 +1,126 @@
 from sqlalchemy import create_engine,text
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker
+from sqlalchemy.pool import NullPool
+from contextvars import ContextVar
+from typing import Dict, Optional
+import logging
 import os
+import time
+import asyncio
 import asyncpg
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Use different database URLs for different environments
 if os.getenv("ENVIRONMENT") == "test":
     SQLALCHEMY_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
 else:
     SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Run the sync engine on psycopg 3 and the async engine on asyncpg;
+# the plain URL is kept for the raw asyncpg pool
+SQLALCHEMY_ENGINE_URL = SQLALCHEMY_DATABASE_URL.replace("postgresql://", "postgresql+psycopg://", 1)
+SQLALCHEMY_ASYNC_URL = SQLALCHEMY_DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+# Set DB_PGBOUNCER=true when DATABASE_URL points at PgBouncer in transaction
+# pooling mode: server-side prepared statements don't survive across
+# transactions there, and PgBouncer does the multiplexing, so each worker
+# keeps only a small pool of short-lived client connections.
+DB_PGBOUNCER = os.getenv("DB_PGBOUNCER", "false").lower() in ("1", "true", "yes")
+
+# Worker processes serving the app (uvicorn reads the same variable; the
+# Dockerfile and app.main default it to 4 outside development)
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1" if os.getenv("ENVIRONMENT") == "development" else "4")))
+
+# Connections all workers together may open, kept under Postgres's default
+# max_connections=100. Each worker's share is split across its pools below:
+# sync engine 50%, async engine 20%, realtime asyncpg pool 20%, PGMQ pool 10%.
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "80"))
+DB_WORKER_CONNECTIONS = max(DB_CONNECTION_BUDGET // WEB_CONCURRENCY, 10)
+
+def worker_connection_share(fraction: float, minimum: int = 1) -> int:
+    """This worker's slice of DB_WORKER_CONNECTIONS, at least `minimum`"""
+    return max(int(DB_WORKER_CONNECTIONS * fraction), minimum)
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5" if DB_PGBOUNCER else str(worker_connection_share(0.25))))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "0" if DB_PGBOUNCER else str(worker_connection_share(0.25, 0))))
+DB_ASYNC_POOL_SIZE = int(os.getenv("DB_ASYNC_POOL_SIZE", "2" if DB_PGBOUNCER else str(worker_connection_share(0.1))))
+DB_ASYNC_MAX_OVERFLOW = int(os.getenv("DB_ASYNC_MAX_OVERFLOW", "0" if DB_PGBOUNCER else str(worker_connection_share(0.1, 0))))
+DB_REALTIME_POOL_MAX = int(os.getenv("DB_REALTIME_POOL_MAX", str(worker_connection_share(0.2, 2))))
+# Sync engine connections opened at startup; never more than the pool keeps
+# (overflow connections are closed when returned)
+DB_WARM_SIZE = min(int(os.getenv("DB_WARM_SIZE", "4")), DB_POOL_SIZE)
+DB_POOL_RECYCLE = 300 if DB_PGBOUNCER else 1800
+
+# DB_NULL_POOL=true (only sensible behind PgBouncer) opens a connection per
+# checkout and closes it on return, leaving all pooling to PgBouncer
+DB_NULL_POOL = os.getenv("DB_NULL_POOL", "false").lower() in ("1", "true", "yes")
+
+def _pool_args(pool_size: int, max_overflow: int) -> dict:
+    if DB_NULL_POOL:
+        return {"poolclass": NullPool}
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": 30,
+        "pool_recycle": DB_POOL_RECYCLE,  # Recycle connections after 30 minutes (5 behind PgBouncer)
+        "pool_pre_ping": True,  # Enable connection health checks
+        "pool_use_lifo": True,  # Reuse the most recently returned (warmest) connection first
+    }
+
+# Per-session server settings: bound query and idle-in-transaction time so a
+# stuck query can't pin a pool slot, and skip JIT compilation for short OLTP
+# queries. PgBouncer rejects these as startup parameters, so behind it they
+# belong on the database or role (ALTER ROLE ... SET) instead.
+DB_SERVER_SETTINGS = {} if DB_PGBOUNCER else {
+    "statement_timeout": os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"),
+    "idle_in_transaction_session_timeout": os.getenv("DB_IDLE_IN_TRANSACTION_TIMEOUT_MS", "10000"),
+    "jit": "off",
+}
+
+# Server-side prepare statements run 5+ times (disabled behind PgBouncer)
+_sync_connect_args = {"prepare_threshold": None if DB_PGBOUNCER else 5}
+if DB_SERVER_SETTINGS:
+    _sync_connect_args["options"] = " ".join(f"-c {k}={v}" for k, v in DB_SERVER_SETTINGS.items())
+
+_async_connect_args = {"server_settings": DB_SERVER_SETTINGS}
+if DB_PGBOUNCER:
+    _async_connect_args.update(statement_cache_size=0, prepared_statement_cache_size=0)
+
 # Pool configuration for better performance
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    pool_size=20,
-    max_overflow=30,
-    pool_timeout=30,
-    pool_recycle=1800,  # Recycle connections after 30 minutes
-    pool_pre_ping=True,  # Enable connection health checks
+    SQLALCHEMY_ENGINE_URL,
+    **_pool_args(DB_POOL_SIZE, DB_MAX_OVERFLOW),
+    insertmanyvalues_page_size=1000,  # Rows per multi-VALUES INSERT ... RETURNING
+    isolation_level="READ COMMITTED",
+    connect_args=_sync_connect_args,
     echo=bool(os.getenv("DEBUG", False))  # Echo SQL queries in debug mode
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# One session per request: DBSessionScope (app.middleware) sets a fresh scope
+# key for each HTTP/WebSocket request and removes the session when the request
+# ends, so every get_db consumer in a request (including threadpool handlers,
+# which inherit the request's context) shares one session and connection
+_request_scope: ContextVar[Optional[object]] = ContextVar("db_request_scope", default=None)
+ScopedSession = scoped_session(SessionLocal, scopefunc=_request_scope.get)
+
+# Async engine for handlers that await the database instead of blocking the event loop
+async_engine = create_async_engine(
+    SQLALCHEMY_ASYNC_URL,
+    **_pool_args(DB_ASYNC_POOL_SIZE, DB_ASYNC_MAX_OVERFLOW),
+    isolation_level="READ COMMITTED",
+    connect_args=_async_connect_args,
+    echo=bool(os.getenv("DEBUG", False))
+)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -33,12 +128,26 @@ def get_db():
     Dependency function to get database session.
     Use this in your route dependencies.
     """
+    if _request_scope.get() is not None:
+        # Closed by DBSessionScope at the end of the request
+        yield ScopedSession()
+        return
+
+    # Outside a request scope (scripts, tests): plain per-call session
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+async def get_async_db():
+    """
+    Dependency function to get an async database session.
+    Use this in async route dependencies.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def test_connection():
     """Test database connection"""
     try:
@@ -49,6 +158,61 @@ def test_connection():
         print(f"Database connection error: {e}")
         return False
 
+async def test_connection_async():
+    """Test database connection without blocking the event loop"""
+    try:
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        return True
+    except Exception as e:
+        print(f"Database connection error: {e}")
+        return False
+
+# [checked_at, ok] for cached_db_ok
+_db_ok = [0.0, False]
+
+async def cached_db_ok(ttl: float = 2.0):
+    """Database connectivity, re-checked at most once per ttl seconds (for probes)"""
+    now = time.monotonic()
+    if now - _db_ok[0] > ttl:
+        _db_ok[1] = await test_connection_async()
+        _db_ok[0] = now
+    return _db_ok[1]
+
+def pool_stats() -> Dict[str, Dict[str, int]]:
+    """Connection gauges for the sync and async engine pools (empty under NullPool)"""
+    if DB_NULL_POOL:
+        return {}
+    stats = {}
+    for name, pool in (("sync", engine.pool), ("async", async_engine.pool)):
+        stats[name] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+        }
+    return stats
+
+async def warm_connection_pool():
+    """Open DB_WARM_SIZE sync engine connections up front so early requests skip the handshake"""
+    if DB_NULL_POOL or DB_WARM_SIZE <= 0:
+        return
+
+    def connect():
+        conn = engine.connect()
+        conn.execute(text("SELECT 1"))
+        return conn
+
+    start = time.perf_counter()
+    # Hold them all at once so each is a distinct connection, then return them to the pool
+    conns = await asyncio.gather(*(asyncio.to_thread(connect) for _ in range(DB_WARM_SIZE)), return_exceptions=True)
+    opened = [c for c in conns if not isinstance(c, Exception)]
+    await asyncio.gather(*(asyncio.to_thread(c.close) for c in opened))
+    for error in conns:
+        if isinstance(error, Exception):
+            raise error
+    logger.info("Warmed %d database connections in %.0fms", len(opened), (time.perf_counter() - start) * 1000)
+
 # Async database pool for real-time features
 db_pool = None
 
@@ -60,12 +224,21 @@ async def create_db_pool():
         db_url = SQLALCHEMY_DATABASE_URL.replace("postgresql://", "postgresql://")
         db_pool = await asyncpg.create_pool(
             db_url,
-            min_size=5,
-            max_size=20,
-            command_timeout=60
+            min_size=1,
+            max_size=DB_REALTIME_POOL_MAX,
+            command_timeout=60,
+            statement_cache_size=0 if DB_PGBOUNCER else 100,
+            server_settings=DB_SERVER_SETTINGS
         )
     return db_pool
 
+async def close_db_pool():
+    """Close async database connection pool"""
+    global db_pool
+    if db_pool is not None:
+        await db_pool.close()
+        db_pool = None
+
 def get_db_pool():
     """Get the database pool (synchronous access)"""
     global db_pool
@@ -1,88 +1,142 @@
-from fastapi import FastAPI, Depends, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy.orm import Session
-import time
-from datetime import datetime
+import asyncio
+import logging
 import os
+from typing import Optional
 
-from app.database import engine, get_db, test_connection
+from app.database import WEB_CONCURRENCY, async_engine, SessionLocal, test_connection_async, cached_db_ok, create_db_pool, close_db_pool, warm_connection_pool
 from app import models
+from app.middleware import DBSessionScope, FastCORS
 from app.routes import auth, courses, favorites, chat, profile, admin, teacher_codes, clerk_webhooks, uploads, notifications, upload
 from app.rbac import initialize_rbac
 from app.queue_service import pgmq_service
+from app.realtime import manager
+from app.clerk import clerk_client
+from app.clerk_jwt import clerk_jwks
+from app.utils import helpers
 
-# Create database tables
-try:
-    models.Base.metadata.create_all(bind=engine)
-    print("Database tables created successfully")
-except Exception as e:
-    print(f"Error creating database tables: {e}")
-    # Wait and retry (useful for Docker startup)
-    time.sleep(2)
-    try:
-        models.Base.metadata.create_all(bind=engine)
-        print("Database tables created on retry")
-    except Exception as e2:
-        print(f"Failed to create database tables after retry: {e2}")
+# Set up before anything logs; stopped in shutdown_event to flush the queue
+_log_listener = helpers.configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="REGOD API",
     version="1.0.0",
     description="A comprehensive learning platform backend with Clerk authentication",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse
 )
 
+# Per-request database session scope
+app.add_middleware(DBSessionScope)
+
 # CORS middleware
 app.add_middleware(
-    CORSMiddleware,
+    FastCORS,
     allow_origins=[
         "*", 
     ],
     allow_credentials=True,  # Allow credentials for authenticated requests
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # Keyset paging cursor for /api/admin/users
 )
 
-# Mount static files for uploads
+# Mount static files for uploads. In production set SERVE_UPLOADS=0 and let
+# nginx serve the directory with sendfile (see nginx.uploads.conf).
 upload_dir = os.getenv("LOCAL_UPLOAD_DIR", os.path.join(os.getcwd(), "uploads"))
 os.makedirs(upload_dir, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=upload_dir), name="uploads")
+if os.getenv("SERVE_UPLOADS", "1") == "1":
+    app.mount("/uploads", StaticFiles(directory=upload_dir), name="uploads")
 
-# Initialize RBAC system on startup
-@app.on_event("startup")
-async def startup_event():
-    db = next(get_db())
+INIT_SCHEMA = os.getenv("INIT_SCHEMA", "1" if os.getenv("ENVIRONMENT") == "development" else "0") == "1"
+
+def _initialize_rbac():
+    """Seed roles and permissions using a dedicated session (runs in a worker thread)"""
+    db = SessionLocal()
     try:
         initialize_rbac(db)
-        print("RBAC system initialized successfully")
-        
-        # Test database connection
-        if test_connection():
-            print("Database connection: OK")
-        else:
-            print("Database connection: FAILED")
-        
-        # Initialize PGMQ service
-        await pgmq_service.initialize()
-        await pgmq_service.start_workers()
-        print("PGMQ service initialized successfully")
-            
-    except Exception as e:
-        print(f"Error initializing services: {e}")
     finally:
         db.close()
 
+# Background task refreshing helpers.CURRENT_TS
+_ts_ticker = None
+
+# Initialize RBAC system on startup
+@app.on_event("startup")
+async def startup_event():
+    global _ts_ticker
+    _ts_ticker = asyncio.create_task(helpers.tick_current_ts())
+
+    # Create database tables only when asked to (INIT_SCHEMA=1, on by default in
+    # development); otherwise run it once from a one-shot init job so workers
+    # don't each introspect the whole schema at boot
+    if INIT_SCHEMA:
+        try:
+            async with async_engine.begin() as conn:
+                await conn.run_sync(models.Base.metadata.create_all)
+            logger.info("Database tables created successfully")
+        except Exception as e:
+            logger.error("Error creating database tables: %s", e)
+
+    clerk_jwks.start_refresh()
+
+    # Independent I/O setup runs concurrently; RBAC seeding is sync ORM work,
+    # so it runs in a thread instead of blocking the loop
+    rbac_result, db_ok, pool_result, pgmq_result = await asyncio.gather(
+        asyncio.to_thread(_initialize_rbac),
+        test_connection_async(),
+        create_db_pool(),
+        pgmq_service.initialize(),
+        return_exceptions=True
+    )
+    if isinstance(rbac_result, Exception):
+        logger.error("Error initializing RBAC: %s", rbac_result)
+    else:
+        logger.info("RBAC system initialized successfully")
+    if db_ok is True:
+        logger.info("Database connection: OK")
+    else:
+        logger.error("Database connection: FAILED")
+    for name, result in (("database pool", pool_result), ("PGMQ service", pgmq_result)):
+        if isinstance(result, Exception):
+            logger.error("Error initializing %s: %s", name, result)
+
+    # These need the pools (and RBAC data) from the step above
+    results = await asyncio.gather(
+        warm_connection_pool(),
+        manager.start_notification_listener(),
+        pgmq_service.start_workers(),
+        return_exceptions=True
+    )
+    errors = [r for r in results if isinstance(r, Exception)]
+    for error in errors:
+        logger.error("Error initializing services: %s", error)
+    if not errors:
+        logger.info("PGMQ service initialized successfully")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if _ts_ticker:
+        _ts_ticker.cancel()
+    await clerk_client.aclose()
+    await clerk_jwks.aclose()
+    await pgmq_service.aclose()
+    await close_db_pool()
+    await async_engine.dispose()
+    _log_listener.stop()
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    db_status = "healthy" if test_connection() else "unhealthy"
+    db_status = "healthy" if await cached_db_ok() else "unhealthy"
     return {
         "status": "ok",
         "database": db_status,
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": helpers.CURRENT_TS,
         "service": "regod-backend"
     }
 
@@ -99,8 +153,25 @@ app.include_router(uploads.router, prefix="/api", tags=["Uploads"])
 app.include_router(upload.router, prefix="/api/upload", tags=["File Upload"])
 app.include_router(notifications.router, prefix="/api/notifications", tags=["Notifications"])
 
+APP_VERSION = "1.0.0"
+
+# Cacheable by clients and CDNs; revalidated with the ETag once stale
+STATIC_CACHE_CONTROL = "public, max-age=60, stale-while-revalidate=300"
+
+def _not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Return a 304 if the client already holds this ETag"""
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": STATIC_CACHE_CONTROL})
+    return None
+
 @app.get("/")
-async def root():
+async def root(request: Request, response: Response):
+    etag = f'"root-{APP_VERSION}"'
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = STATIC_CACHE_CONTROL
     return {
         "message": "Welcome to REGOD API",
         "docs": "/docs",
@@ -108,19 +179,34 @@ async def root():
     }
 
 @app.get("/api/init")
-async def initialize_app(db: Session = Depends(get_db)):
+async def initialize_app(request: Request, response: Response):
+    database_connected = await cached_db_ok()
+    # The body only varies with the version and DB status, so they make the ETag
+    etag = f'"init-{APP_VERSION}-{int(database_connected)}"'
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = STATIC_CACHE_CONTROL
     return {
         "show_onboarding": True,
-        "app_version": "1.0.0",
+        "app_version": APP_VERSION,
         "maintenance_mode": False,
-        "database_connected": test_connection()
+        "database_connected": database_connected
     }
 
 if __name__ == "__main__":
     import uvicorn
+
+    # uvloop (libuv) event loop and the httptools (C) HTTP parser; one process
+    # per WEB_CONCURRENCY worker, or a single reloading process in development
+    development = os.getenv("ENVIRONMENT") == "development"
     uvicorn.run(
-        app, 
+        "app.main:app",
         host="0.0.0.0", 
         port=8000,
-        reload=True if os.getenv("ENVIRONMENT") == "development" else False
-    )
\ No newline at end of file
+        loop="uvloop",
+        http="httptools",
+        workers=None if development else WEB_CONCURRENCY,
+        reload=development
+    )
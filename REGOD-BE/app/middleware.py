@@ -0,0 +1,107 @@
+from typing import Iterable
+
+from starlette.concurrency import run_in_threadpool
+
+from app.database import ScopedSession, _request_scope
+
+
+class FastCORS:
+    """
+    Pure ASGI CORS middleware.
+
+    All response headers are encoded once at startup; per request the middleware
+    only scans the raw request headers, answers preflights directly and appends
+    the CORS headers to the response start message.
+    """
+
+    def __init__(
+        self,
+        app,
+        allow_origins: Iterable[str] = ("*",),
+        allow_methods: Iterable[str] = ("GET",),
+        allow_credentials: bool = False,
+        expose_headers: Iterable[str] = (),
+        max_age: int = 600,
+    ):
+        self.app = app
+        origins = list(allow_origins)
+        self.allow_all_origins = "*" in origins
+        self.allow_origins = frozenset(o.encode("latin-1") for o in origins)
+        # With credentials the browser rejects "*", so the request origin is echoed back
+        self.echo_origin = allow_credentials or not self.allow_all_origins
+
+        common = [(b"vary", b"Origin")]
+        if allow_credentials:
+            common.append((b"access-control-allow-credentials", b"true"))
+        self.simple_headers = list(common)
+        expose = list(expose_headers)
+        if expose:
+            # Response headers cross-origin scripts may read (e.g. X-Next-Cursor)
+            self.simple_headers.append((b"access-control-expose-headers", ", ".join(expose).encode("latin-1")))
+        self.preflight_headers = common + [
+            (b"access-control-allow-methods", ", ".join(allow_methods).encode("latin-1")),
+            (b"access-control-max-age", str(max_age).encode("latin-1")),
+            (b"content-length", b"0"),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        origin = request_method = request_headers = None
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+
+        if origin is None or not (self.allow_all_origins or origin in self.allow_origins):
+            await self.app(scope, receive, send)
+            return
+
+        allow_origin = (b"access-control-allow-origin", origin if self.echo_origin else b"*")
+
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            headers = [allow_origin, *self.preflight_headers]
+            if request_headers:
+                headers.append((b"access-control-allow-headers", request_headers))
+            await send({"type": "http.response.start", "status": 200, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        extra = [allow_origin, *self.simple_headers]
+
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *extra]
+            await send(message)
+
+        await self.app(scope, receive, send_with_cors)
+
+
+class DBSessionScope:
+    """
+    Pure ASGI middleware giving each HTTP/WebSocket request its own
+    ScopedSession, removed (closed, connection returned to the pool) once the
+    request finishes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        token = _request_scope.set(object())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # Closing may roll back on the connection, so keep it off the loop
+            if ScopedSession.registry.has():
+                await run_in_threadpool(ScopedSession.remove)
+            _request_scope.reset(token)
@@ -1,11 +1,13 @@
 from sqlalchemy import (
     Boolean, Column, ForeignKey, String, DateTime,
-    Float, Text, Table, Integer, UniqueConstraint
+    Float, Text, Table, Integer, UniqueConstraint, Index, DDL, event
 )
-from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.sql import func, text
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 import uuid
+from datetime import datetime
+from typing import Any, Optional
 from app.database import Base
 
 
@@ -18,7 +20,11 @@ user_roles = Table(
     Column("user_id", UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE")),
     Column("role_id", Integer, ForeignKey("roles.id", ondelete="CASCADE")),
     Column("assigned_at", DateTime(timezone=True), server_default=func.now()),
-    Column("assigned_by", UUID(as_uuid=True), ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    Column("assigned_by", UUID(as_uuid=True), ForeignKey("users.id", ondelete="SET NULL"), nullable=True),
+    # Role directory/count queries filter by role and join back to users
+    Index("ix_user_roles_role_user", "role_id", "user_id"),
+    # Per-user role checks (EXISTS / NOT EXISTS on user_id)
+    Index("ix_user_roles_user_role", "user_id", "role_id")
 )
 
 role_permissions = Table(
@@ -46,29 +52,29 @@ user_permissions = Table(
 class User(Base):
     __tablename__ = "users"
 
-    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
-    email = Column(String, unique=True, index=True, nullable=False)
-    hashed_password = Column(String, nullable=True)
-    name = Column(String, nullable=False)
-    phone = Column(String, nullable=True)
-    age = Column(Integer, nullable=True)
-    avatar_url = Column(String, nullable=True)
-    clerk_user_id = Column(String, nullable=True, unique=True, index=True)
-    is_active = Column(Boolean, default=True)
-    is_verified = Column(Boolean, default=False)
-    onboarding_completed = Column(Boolean, default=False)
-    expo_push_token = Column(String, nullable=True)
+    id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
+    email: Mapped[str] = mapped_column(String, unique=True, index=True, nullable=False)
+    hashed_password: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    name: Mapped[str] = mapped_column(String, nullable=False)
+    phone: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    age: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    avatar_url: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    clerk_user_id: Mapped[Optional[str]] = mapped_column(String, nullable=True, unique=True, index=True)
+    is_active: Mapped[Optional[bool]] = mapped_column(Boolean, default=True)
+    is_verified: Mapped[Optional[bool]] = mapped_column(Boolean, default=False)
+    onboarding_completed: Mapped[Optional[bool]] = mapped_column(Boolean, default=False)
+    expo_push_token: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     # Time tracking - stores last 7 days of learning time
-    weekly_time_data = Column(JSONB, nullable=True, default=list)
+    weekly_time_data: Mapped[Any] = mapped_column(JSONB, nullable=True, default=list)
     # Church-related fields
-    church_admin_name = Column(String, nullable=True)
-    home_church = Column(String, nullable=True)
-    country = Column(String, nullable=True)
-    city = Column(String, nullable=True)
-    postal_code = Column(String, nullable=True)
-    church_admin_cell_phone = Column(String, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    last_login = Column(DateTime(timezone=True), nullable=True)
+    church_admin_name: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    home_church: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    country: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    city: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    postal_code: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    church_admin_cell_phone: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    last_login: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
 
     # Relationships
     courses = relationship("UserCourseProgress", back_populates="user")
@@ -95,30 +101,36 @@ class User(Base):
         secondaryjoin="Permission.id==user_permissions.c.permission_id"
     )
 
+    __table_args__ = (
+        # Keyset pagination for the admin user listing
+        Index("ix_users_created_at_id", "created_at", "id"),
+    )
+
+    @property
+    def _perm_set(self) -> frozenset:
+        """Names of permissions granted via roles, built once per loaded instance"""
+        perms = self.__dict__.get("_perm_set_cache")
+        if perms is None:
+            perms = frozenset(permission.name for role in self.roles for permission in role.permissions)
+            self.__dict__["_perm_set_cache"] = perms
+        return perms
+
+    @property
+    def _user_perm_set(self) -> frozenset:
+        """Names of permissions granted directly to the user, built once per loaded instance"""
+        perms = self.__dict__.get("_user_perm_set_cache")
+        if perms is None:
+            perms = frozenset(permission.name for permission in self.user_permissions)
+            self.__dict__["_user_perm_set_cache"] = perms
+        return perms
+
     def has_permission(self, permission_name: str) -> bool:
-        # Check if user has the specific permission at user level (highest priority)
-        has_user_permission = any(
-            permission.name == permission_name
-            for permission in self.user_permissions
-        )
-        if has_user_permission:
+        # User-level permissions take priority, then role permissions;
+        # admin:all on a role grants everything
+        if permission_name in self._user_perm_set:
             return True
-        
-        # Check if user has the specific permission via their roles
-        has_role_permission = any(
-            permission.name == permission_name
-            for role in self.roles
-            for permission in role.permissions
-        )
-        
-        # Check if user has admin:all permission (grants all permissions)
-        has_admin_all = any(
-            permission.name == "admin:all"
-            for role in self.roles
-            for permission in role.permissions
-        )
-        
-        return has_role_permission or has_admin_all
+        role_perms = self._perm_set
+        return permission_name in role_perms or "admin:all" in role_perms
 
     def has_role(self, role_name: str) -> bool:
         return any(role.name == role_name for role in self.roles)
@@ -140,7 +152,9 @@ class Role(Base):
         primaryjoin="Role.id==user_roles.c.role_id",
         secondaryjoin="User.id==user_roles.c.user_id"
     )
-    permissions = relationship("Permission", secondary=role_permissions, back_populates="roles")
+    # Loaded in one batched SELECT for all roles in the result, so walking
+    # user.roles -> role.permissions costs one query instead of one per role
+    permissions = relationship("Permission", secondary=role_permissions, back_populates="roles", lazy="selectin")
 
 
 class Permission(Base):
@@ -199,12 +213,17 @@ class TeacherAssignment(Base):
     student = relationship("User", foreign_keys=[student_id], back_populates="student_assignments")
     assigner = relationship("User", foreign_keys=[assigned_by])
 
+    __table_args__ = (
+        UniqueConstraint('teacher_id', 'student_id', name='unique_teacher_student_assignment'),
+    )
+
 
 class TeacherCode(Base):
     __tablename__ = "teacher_codes"
 
     id = Column(Integer, primary_key=True, index=True)
-    code = Column(String, unique=True, index=True, nullable=False)
+    # Generated in the database by gen_teacher_code() (init.sql / migrate_teacher_code_default.sql)
+    code = Column(String, unique=True, index=True, nullable=False, server_default=text("gen_teacher_code()"))
     teacher_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     expires_at = Column(DateTime(timezone=True), nullable=True)
@@ -216,6 +235,29 @@ class TeacherCode(Base):
     student_uses = relationship("TeacherCodeUse", back_populates="teacher_code", cascade="all, delete-orphan")
 
 
+# create_all() must define gen_teacher_code() before CREATE TABLE references it
+# as the code default (same function as init.sql / migrate_teacher_code_default.sql)
+event.listen(
+    TeacherCode.__table__,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pgcrypto").execute_if(dialect="postgresql"),
+)
+event.listen(
+    TeacherCode.__table__,
+    "before_create",
+    DDL("""
+CREATE OR REPLACE FUNCTION gen_teacher_code(len integer DEFAULT 8) RETURNS text
+LANGUAGE sql VOLATILE AS $$
+    SELECT string_agg(
+        substr('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789',
+               (((get_byte(r.b, 2 * i) << 8) | get_byte(r.b, 2 * i + 1)) %% 36) + 1, 1),
+        '' ORDER BY i)
+    FROM (SELECT gen_random_bytes(2 * len) AS b) r, generate_series(0, len - 1) AS i
+$$
+""").execute_if(dialect="postgresql"),
+)
+
+
 class TeacherCodeUse(Base):
     __tablename__ = "teacher_code_uses"
 
@@ -283,35 +325,42 @@ class Chapter(Base):
 class Module(Base):
     __tablename__ = "modules"
 
-    id = Column(Integer, primary_key=True, index=True)
-    course_id = Column(Integer, ForeignKey("courses.id", ondelete="CASCADE"))
-    chapter_id = Column(Integer, ForeignKey("chapters.id", ondelete="CASCADE"), nullable=True)
-    title = Column(String, index=True, nullable=False)
-    description = Column(Text, nullable=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    course_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("courses.id", ondelete="CASCADE"))
+    chapter_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("chapters.id", ondelete="CASCADE"), nullable=True)
+    title: Mapped[str] = mapped_column(String, index=True, nullable=False)
+    description: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     # Content fields to support mobile lesson page
-    content = Column(Text, nullable=True)
-    key_verses = Column(Text, nullable=True)
-    key_verses_ref = Column(String, nullable=True)
-    key_verses_json = Column(JSONB, nullable=True)
-    lesson_study = Column(Text, nullable=True)
-    lesson_study_ref = Column(String, nullable=True)
-    response_prompt = Column(Text, nullable=True)
-    music_selection = Column(Text, nullable=True)
-    further_study = Column(Text, nullable=True)
-    further_study_json = Column(JSONB, nullable=True)
-    personal_experiences = Column(Text, nullable=True)
-    resources = Column(Text, nullable=True)
-    resources_json = Column(JSONB, nullable=True)
-    artwork = Column(Text, nullable=True)
-    header_image_url = Column(String, nullable=True)
-    media_url = Column(String, nullable=True)  # consolidated audio/video URL
-    quiz = Column(JSONB, nullable=True)  # structured quiz data
-    order = Column(Integer, default=0)
-    is_active = Column(Boolean, default=True)
+    content: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    key_verses: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    key_verses_ref: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    key_verses_json: Mapped[Any] = mapped_column(JSONB(none_as_null=True), nullable=True)
+    lesson_study: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    lesson_study_ref: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    response_prompt: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    music_selection: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    further_study: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    further_study_json: Mapped[Any] = mapped_column(JSONB(none_as_null=True), nullable=True)
+    personal_experiences: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    resources: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    resources_json: Mapped[Any] = mapped_column(JSONB(none_as_null=True), nullable=True)
+    artwork: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    header_image_url: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    media_url: Mapped[Optional[str]] = mapped_column(String, nullable=True)  # consolidated audio/video URL
+    quiz: Mapped[Any] = mapped_column(JSONB(none_as_null=True), nullable=True)  # structured quiz data
+    order: Mapped[Optional[int]] = mapped_column(Integer, default=0)
+    is_active: Mapped[Optional[bool]] = mapped_column(Boolean, default=True)
 
     course = relationship("Course", back_populates="modules")
     chapter = relationship("Chapter", back_populates="modules")
 
+    # jsonb_path_ops GIN indexes serve containment (@>) lookups into the JSON content
+    __table_args__ = (
+        Index("ix_modules_quiz_gin", "quiz", postgresql_using="gin", postgresql_ops={"quiz": "jsonb_path_ops"}),
+        Index("ix_modules_key_verses_json_gin", "key_verses_json", postgresql_using="gin",
+              postgresql_ops={"key_verses_json": "jsonb_path_ops"}),
+    )
+
 
 class UserCourseProgress(Base):
     __tablename__ = "user_course_progress"
@@ -330,6 +379,10 @@ class UserCourseProgress(Base):
     course = relationship("Course")
     last_visited_module = relationship("Module")
 
+    __table_args__ = (
+        Index("ix_user_course_progress_user_course", "user_id", "course_id"),
+    )
+
 
 class UserModuleProgress(Base):
     __tablename__ = "user_module_progress"
@@ -342,6 +395,10 @@ class UserModuleProgress(Base):
     completed_at = Column(DateTime(timezone=True), nullable=True)
     quiz_score = Column(Integer, nullable=True)  # Quiz score percentage (0-100)
 
+    __table_args__ = (
+        Index("ix_user_module_progress_user_module", "user_id", "module_id", postgresql_include=["status"]),
+    )
+
 
 class UserNote(Base):
     __tablename__ = "user_notes"
@@ -377,18 +434,24 @@ class ChatThread(Base):
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
 
-    id = Column(Integer, primary_key=True, index=True)
-    thread_id = Column(Integer, ForeignKey("chat_threads.id", ondelete="CASCADE"))
-    sender_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"))
-    sender_type = Column(String, default="user")  # user or teacher
-    content = Column(Text, nullable=False)
-    message_type = Column(String, default="text")  # text, image, file
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())
-    read_status = Column(Boolean, default=False)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    thread_id: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey("chat_threads.id", ondelete="CASCADE"))
+    sender_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"))
+    sender_type: Mapped[Optional[str]] = mapped_column(String, default="user")  # user or teacher
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    message_type: Mapped[Optional[str]] = mapped_column(String, default="text")  # text, image, file
+    timestamp: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    read_status: Mapped[Optional[bool]] = mapped_column(Boolean, default=False)
 
     thread = relationship("ChatThread", back_populates="messages")
     sender = relationship("User")
 
+    # Serves "messages in a thread ordered by time"; content is deliberately not
+    # included since long messages would exceed the btree row size limit
+    __table_args__ = (
+        Index("ix_chat_messages_thread_ts", "thread_id", "timestamp", postgresql_include=["sender_id", "read_status"]),
+    )
+
 
 # User Favorites for Lessons
 class UserFavorite(Base):
@@ -1,15 +1,75 @@
 import asyncio
-import json
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 import asyncpg
+import httpx
+import msgspec
 import os
 from dotenv import load_dotenv
 
+from app.database import DB_PGBOUNCER, worker_connection_share
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# pgmq.read arguments: visibility timeout (s) and batch size
+READ_VT = 30
+READ_QTY = 100
+
+# Senders NOTIFY this channel with the queue name; idle workers wait on it,
+# falling back to a poll every WAKE_TIMEOUT seconds if a wakeup is missed
+WAKE_CHANNEL = 'pgmq_wake'
+WAKE_TIMEOUT = 5
+
+EXPO_PUSH_URL = 'https://exp.host/--/api/v2/push/send'
+# Expo accepts at most 100 messages per push request
+EXPO_BATCH_SIZE = 100
+# Reads after which a notification whose push keeps failing is dropped
+PUSH_MAX_ATTEMPTS = 5
+
+# Queue statements. Each one is parsed and planned once per connection and
+# then served from asyncpg's per-connection prepared statement cache.
+# pg_notify is transactional, so the wakeup is only sent once the message is committed
+_SEND_SQL = f"SELECT pgmq.send($1, $2::jsonb), pg_notify('{WAKE_CHANNEL}', $1)"
+_READ_SQL = "SELECT * FROM pgmq.read($1, $2, $3)"
+# Chat notifications come back with the recipient's push token already joined in
+_READ_CHAT_SQL = """
+    SELECT r.msg_id, r.read_ct, r.message, u.expo_push_token
+    FROM pgmq.read($1, $2, $3) r
+    LEFT JOIN users u ON u.id = (r.message->>'user_id')::uuid
+"""
+_DELETE_SQL = "SELECT pgmq.delete($1, $2::bigint[])"
+# The UPDATE CTE runs even though the outer SELECT doesn't read it
+_MARK_DELIVERED_SQL = """
+    WITH delivered AS (
+        UPDATE chat_messages m
+        SET delivery_status = 'delivered', delivered_at = NOW()
+        FROM unnest($2::text[], $3::text[]) AS d(message_id, recipient_id)
+        WHERE m.id = d.message_id::integer AND m.recipient_id::text = d.recipient_id
+    )
+    SELECT pgmq.delete($1, $4::bigint[])
+"""
+
+# Queue payload schemas. pgmq stores messages as jsonb, so they are encoded
+# with msgspec's JSON codec (validated, typed, no intermediate dicts)
+class ChatNotification(msgspec.Struct):
+    user_id: str
+    type: str
+    data: Dict[str, Any]
+    timestamp: Optional[str] = None
+
+class MessageDelivery(msgspec.Struct):
+    thread_id: int
+    message_id: str
+    recipient_id: str
+    type: str = 'message_delivery'
+    status: str = 'delivered'
+
+_encoder = msgspec.json.Encoder()
+_decode_chat = msgspec.json.Decoder(ChatNotification).decode
+_decode_delivery = msgspec.json.Decoder(MessageDelivery).decode
+
 class PGMQService:
     def __init__(self):
         self.db_pool = None
@@ -17,9 +77,47 @@ class PGMQService:
             'chat_notifications': 'chat_notifications',
             'message_delivery': 'message_delivery'
         }
+        # Per-queue wakeup events, set from the LISTEN connection
+        self._wake = {queue: asyncio.Event() for queue in self.queues.values()}
+        self._listener_conn = None
+        # Worker tasks, kept so they aren't garbage-collected and can be cancelled
+        self._workers: List[asyncio.Task] = []
+        # Shared keep-alive client for Expo push requests
+        self._http = httpx.AsyncClient(
+            headers={
+                'Accept': 'application/json',
+                'Accept-encoding': 'gzip, deflate',
+                'Content-Type': 'application/json',
+            },
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+            timeout=10.0
+        )
+
+    async def aclose(self):
+        """Stop the workers and close the LISTEN connection, database pool and
+        HTTP client (called on application shutdown)"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._listener_conn is not None:
+            try:
+                await self._listener_conn.remove_listener(WAKE_CHANNEL, self._on_wake)
+                await self.db_pool.release(self._listener_conn)
+            except Exception as e:
+                logger.warning(f"Error releasing queue listener connection: {e}")
+            self._listener_conn = None
+        if self.db_pool is not None:
+            await self.db_pool.close()
+            self.db_pool = None
+        await self._http.aclose()
 
     async def initialize(self):
-        """Initialize PGMQ service with database connection"""
+        """Initialize PGMQ service with database connection (no-op once initialized)"""
+        if self.db_pool is not None:
+            return
+        
         try:
             # Create async database pool
             database_url = os.getenv("DATABASE_URL")
@@ -36,9 +134,11 @@ class PGMQService:
             
             self.db_pool = await asyncpg.create_pool(
                 db_url,
-                min_size=2,
-                max_size=10,
-                command_timeout=60
+                min_size=1,
+                # Also holds the wake-up LISTEN connection, hence at least 3
+                max_size=int(os.getenv("PGMQ_POOL_MAX", str(worker_connection_share(0.1, 3)))),
+                command_timeout=60,
+                statement_cache_size=0 if DB_PGBOUNCER else 100
             )
             logger.info("PGMQ Service initialized with database pool")
         except Exception as e:
@@ -55,14 +155,14 @@ class PGMQService:
             async with self.db_pool.acquire() as conn:
                 # Send notification to chat_notifications queue
                 await conn.execute(
-                    "SELECT pgmq.send($1, $2)",
+                    _SEND_SQL,
                     self.queues['chat_notifications'],
-                    json.dumps({
-                        'user_id': user_id,
-                        'type': 'chat_notification',
-                        'data': message_data,
-                        'timestamp': message_data.get('timestamp')
-                    })
+                    _encoder.encode(ChatNotification(
+                        user_id=user_id,
+                        type='chat_notification',
+                        data=message_data,
+                        timestamp=message_data.get('timestamp')
+                    )).decode()
                 )
                 logger.info(f"Chat notification queued for user {user_id}")
         except Exception as e:
@@ -77,179 +177,193 @@ class PGMQService:
         try:
             async with self.db_pool.acquire() as conn:
                 await conn.execute(
-                    "SELECT pgmq.send($1, $2)",
+                    _SEND_SQL,
                     self.queues['message_delivery'],
-                    json.dumps({
-                        'thread_id': thread_id,
-                        'message_id': message_id,
-                        'recipient_id': recipient_id,
-                        'type': 'message_delivery',
-                        'status': 'delivered'
-                    })
+                    _encoder.encode(MessageDelivery(
+                        thread_id=thread_id,
+                        message_id=message_id,
+                        recipient_id=recipient_id
+                    )).decode()
                 )
                 logger.info(f"Message delivery notification queued for thread {thread_id}")
         except Exception as e:
             logger.error(f"Error sending delivery notification: {e}")
 
-    async def process_chat_notifications(self):
-        """Process chat notifications from the queue"""
+    async def process_chat_notifications(self) -> int:
+        """Process chat notifications from the queue; returns how many were read"""
         if not self.db_pool:
-            return
+            return 0
         
         try:
             async with self.db_pool.acquire() as conn:
                 # Read messages from chat_notifications queue
                 messages = await conn.fetch(
-                    "SELECT * FROM pgmq.read($1, 10, 5)",
-                    self.queues['chat_notifications']
+                    _READ_CHAT_SQL,
+                    self.queues['chat_notifications'],
+                    READ_VT, READ_QTY
                 )
                 
+                processed_ids = []
+                to_push = []  # (msg_id, read_ct, Expo message)
                 for msg in messages:
                     try:
-                        data = json.loads(msg['message'])
-                        user_id = data['user_id']
-                        notification_type = data['type']
-                        
-                        if notification_type == 'chat_notification':
-                            # Process chat notification
-                            await self._process_chat_notification(data)
-                        
-                        # Delete processed message
-                        await conn.execute(
-                            "SELECT pgmq.delete($1, $2)",
-                            self.queues['chat_notifications'],
-                            msg['msg_id']
-                        )
-                        
+                        data = _decode_chat(msg['message'])
                     except Exception as e:
-                        logger.error(f"Error processing notification message: {e}")
+                        logger.error(f"Dropping invalid notification message {msg['msg_id']}: {e}")
+                        processed_ids.append(msg['msg_id'])
+                        continue
+                    if data.type != 'chat_notification':
+                        processed_ids.append(msg['msg_id'])
+                    elif msg['expo_push_token']:
+                        to_push.append((msg['msg_id'], msg['read_ct'], self._build_expo_message(msg['expo_push_token'], data.data)))
+                    else:
+                        logger.info(f"No push token found for user {data.user_id}")
+                        processed_ids.append(msg['msg_id'])
+                
+                if to_push:
+                    results = await self._send_expo_push_batch([m for _, _, m in to_push])
+                    for (msg_id, read_ct, _), ok in zip(to_push, results):
+                        # Failed pushes are retried after the visibility
+                        # timeout, up to PUSH_MAX_ATTEMPTS reads
+                        if ok or read_ct >= PUSH_MAX_ATTEMPTS:
+                            processed_ids.append(msg_id)
+                
+                # Delete processed messages in one call; failed ones become
+                # visible again after the visibility timeout
+                if processed_ids:
+                    await conn.execute(
+                        _DELETE_SQL,
+                        self.queues['chat_notifications'],
+                        processed_ids
+                    )
                         
+            return len(messages)
         except Exception as e:
             logger.error(f"Error processing chat notifications: {e}")
+            raise  # let the worker loop back off
 
-    async def _process_chat_notification(self, data: Dict[str, Any]):
-        """Process individual chat notification"""
-        try:
-            user_id = data['user_id']
-            message_data = data['data']
-            
-            logger.info(f"Processing chat notification for user {user_id}: {message_data}")
-            
-            # Get user's push tokens from database
-            async with self.db_pool.acquire() as conn:
-                user_tokens = await conn.fetch(
-                    "SELECT expo_push_token FROM users WHERE id = $1 AND expo_push_token IS NOT NULL",
-                    user_id
-                )
-                
-                if user_tokens:
-                    # Send push notification via Expo
-                    await self._send_expo_push_notification(
-                        user_tokens[0]['expo_push_token'],
-                        message_data
-                    )
-                else:
-                    logger.info(f"No push token found for user {user_id}")
-            
-        except Exception as e:
-            logger.error(f"Error processing chat notification: {e}")
+    @staticmethod
+    def _build_expo_message(expo_push_token: str, message_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the Expo push message for a chat notification"""
+        return {
+            'to': expo_push_token,
+            'title': f"New message from {message_data.get('sender_name', 'Someone')}",
+            'body': message_data.get('content', 'You have a new message'),
+            'data': {
+                'type': 'chat',
+                'thread_id': message_data.get('thread_id'),
+                'sender_name': message_data.get('sender_name'),
+                'timestamp': message_data.get('timestamp')
+            },
+            'sound': 'default',
+            'badge': 1,
+            'channelId': 'chat-messages'
+        }
 
-    async def _send_expo_push_notification(self, expo_push_token: str, message_data: Dict[str, Any]):
-        """Send push notification via Expo Push Service"""
-        try:
-            import requests
-            
-            payload = {
-                'to': expo_push_token,
-                'title': f"New message from {message_data.get('sender_name', 'Someone')}",
-                'body': message_data.get('content', 'You have a new message'),
-                'data': {
-                    'type': 'chat',
-                    'thread_id': message_data.get('thread_id'),
-                    'sender_name': message_data.get('sender_name'),
-                    'timestamp': message_data.get('timestamp')
-                },
-                'sound': 'default',
-                'badge': 1,
-                'channelId': 'chat-messages'
-            }
-            
-            response = requests.post(
-                'https://exp.host/--/api/v2/push/send',
-                headers={
-                    'Accept': 'application/json',
-                    'Accept-encoding': 'gzip, deflate',
-                    'Content-Type': 'application/json',
-                },
-                json=payload
-            )
-            
-            if response.status_code == 200:
-                logger.info(f"Push notification sent successfully to {expo_push_token}")
-            else:
-                logger.error(f"Failed to send push notification: {response.text}")
-                
-        except Exception as e:
-            logger.error(f"Error sending Expo push notification: {e}")
+    async def _send_expo_push_batch(self, push_messages: List[Dict[str, Any]]) -> List[bool]:
+        """Send push notifications via Expo Push Service, EXPO_BATCH_SIZE per
+        request. Returns whether each message was accepted."""
+        results = []
+        for i in range(0, len(push_messages), EXPO_BATCH_SIZE):
+            chunk = push_messages[i:i + EXPO_BATCH_SIZE]
+            try:
+                response = await self._http.post(EXPO_PUSH_URL, json=chunk)
+                if response.status_code == 200:
+                    tickets = response.json().get('data', [])
+                    ok = [t.get('status') == 'ok' for t in tickets]
+                    ok += [False] * (len(chunk) - len(ok))
+                    logger.info(f"Push notifications sent: {sum(ok)}/{len(chunk)} accepted")
+                else:
+                    logger.error(f"Failed to send push notifications: {response.text}")
+                    ok = [False] * len(chunk)
+            except Exception as e:
+                logger.error(f"Error sending Expo push notifications: {e}")
+                ok = [False] * len(chunk)
+            results.extend(ok)
+        return results
 
-    async def process_message_delivery(self):
-        """Process message delivery confirmations"""
+    async def process_message_delivery(self) -> int:
+        """Process message delivery confirmations; returns how many were read"""
         if not self.db_pool:
-            return
+            return 0
         
         try:
             async with self.db_pool.acquire() as conn:
                 messages = await conn.fetch(
-                    "SELECT * FROM pgmq.read($1, 10, 5)",
-                    self.queues['message_delivery']
+                    _READ_SQL,
+                    self.queues['message_delivery'],
+                    READ_VT, READ_QTY
                 )
                 
+                message_ids, recipient_ids, processed_ids = [], [], []
                 for msg in messages:
+                    # Undecodable payloads would fail on every read, so they are
+                    # dropped along with the batch instead of left to retry
+                    processed_ids.append(msg['msg_id'])
                     try:
-                        data = json.loads(msg['message'])
-                        thread_id = data['thread_id']
-                        message_id = data['message_id']
-                        recipient_id = data['recipient_id']
-                        
-                        # Update message delivery status in database
-                        await conn.execute(
-                            """
-                            UPDATE chat_messages 
-                            SET delivery_status = 'delivered', delivered_at = NOW()
-                            WHERE id = $1 AND recipient_id = $2
-                            """,
-                            message_id, recipient_id
-                        )
-                        
-                        # Delete processed message
-                        await conn.execute(
-                            "SELECT pgmq.delete($1, $2)",
-                            self.queues['message_delivery'],
-                            msg['msg_id']
-                        )
-                        
-                        logger.info(f"Message {message_id} marked as delivered to {recipient_id}")
-                        
+                        data = _decode_delivery(msg['message'])
                     except Exception as e:
-                        logger.error(f"Error processing delivery message: {e}")
+                        logger.error(f"Dropping invalid delivery message {msg['msg_id']}: {e}")
+                        continue
+                    message_ids.append(data.message_id)
+                    recipient_ids.append(data.recipient_id)
+                
+                # Mark the whole batch delivered with one unnest() UPDATE and
+                # drop it from the queue in the same statement, so either both
+                # happen or the batch stays queued for retry
+                if processed_ids:
+                    await conn.execute(
+                        _MARK_DELIVERED_SQL,
+                        self.queues['message_delivery'],
+                        message_ids, recipient_ids, processed_ids
+                    )
+                    logger.info(f"Marked {len(processed_ids)} messages as delivered")
                         
+            return len(messages)
         except Exception as e:
             logger.error(f"Error processing message delivery: {e}")
+            raise  # let the worker loop back off
+
+    def _on_wake(self, connection, pid, channel, payload):
+        """LISTEN callback: payload is the name of the queue that got a message"""
+        wake = self._wake.get(payload)
+        if wake is not None:
+            wake.set()
 
     async def start_workers(self):
         """Start background workers for processing queues"""
-        async def worker_loop():
+        if not self.db_pool:
+            logger.warning("PGMQ service not initialized, workers not started")
+            return
+
+        try:
+            self._listener_conn = await self.db_pool.acquire()
+            await self._listener_conn.add_listener(WAKE_CHANNEL, self._on_wake)
+        except Exception as e:
+            # Workers still poll every WAKE_TIMEOUT seconds without it
+            logger.error(f"Error listening for queue wakeups: {e}")
+
+        async def worker_loop(queue, process):
+            wake = self._wake[queue]
             while True:
                 try:
-                    await self.process_chat_notifications()
-                    await self.process_message_delivery()
-                    await asyncio.sleep(1)  # Process every second
-                except Exception as e:
-                    logger.error(f"Error in worker loop: {e}")
+                    # Clear before reading so a send during processing isn't missed
+                    wake.clear()
+                    if await process() >= READ_QTY:
+                        continue  # Probably more waiting; read again right away
+                    try:
+                        await asyncio.wait_for(wake.wait(), WAKE_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        pass
+                except Exception:
+                    logger.exception(f"PGMQ worker for {queue} failed, retrying in 5s")
                     await asyncio.sleep(5)  # Wait before retrying
         
-        # Start workers in background
-        asyncio.create_task(worker_loop())
+        # One worker per queue, so a burst on one doesn't delay the other
+        self._workers = [
+            asyncio.create_task(worker_loop(self.queues['chat_notifications'], self.process_chat_notifications)),
+            asyncio.create_task(worker_loop(self.queues['message_delivery'], self.process_message_delivery)),
+        ]
         logger.info("PGMQ workers started")
 
 # Global PGMQ service instance
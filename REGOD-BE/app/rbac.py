@@ -1,10 +1,13 @@
-from fastapi import Depends, HTTPException, status
+from fastapi import HTTPException, status
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from functools import wraps
-from typing import List, Callable, Any
-from app.database import get_db
+import inspect
+from typing import Dict, List, Callable, Any, Optional
 from app.models import User, Role, Permission
-from app.utils.auth import get_current_user, user_has_permission, user_has_role  # Local JWT-based auth
+from app.utils.auth import user_has_permission, user_has_role  # Local JWT-based auth
 
 # =========================
 # Permission constants
@@ -63,33 +66,71 @@ DEFAULT_ROLES = {
     }
 }
 
+# Each permission gets a bit; each default role's permissions become one int
+# mask, so checks that don't touch the database are an integer AND.
+# initialize_rbac only ever adds these to the stored roles, so a hit here is
+# always backed by the database; anything else falls back to the user's
+# loaded permissions.
+_PERM_BITS = {name: 1 << i for i, name in enumerate(PERMISSIONS)}
+_ROLE_MASKS = {
+    name: sum(_PERM_BITS[perm] for perm in set(data["permissions"]))
+    for name, data in DEFAULT_ROLES.items()
+}
+
+
+def _has_permission(current_user: dict, permission_name: str, bit: int) -> bool:
+    if bit:
+        mask = 0
+        for role in current_user.get("roles", ()):
+            mask |= _ROLE_MASKS.get(role, 0)
+        if mask & bit:
+            return True
+    return user_has_permission(current_user, permission_name)
+
 # =========================
 # Decorators
 # =========================
+def _wrap(func: Callable, check: Callable[[dict], None]) -> Callable:
+    """
+    Wrap an endpoint so check(current_user) runs before it.
+
+    FastAPI resolves dependencies from the endpoint's own signature (it follows
+    __wrapped__), so the endpoint must declare `current_user` and the wrapper
+    just passes every resolved argument through; a database session is only
+    opened when the endpoint itself declares `db`. Plain `def` endpoints get a
+    plain `def` wrapper so FastAPI still runs them in its threadpool.
+    """
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs: Any):
+            check(kwargs.get("current_user"))
+            return await func(*args, **kwargs)
+    else:
+        @wraps(func)
+        def wrapper(*args, **kwargs: Any):
+            check(kwargs.get("current_user"))
+            return func(*args, **kwargs)
+    return wrapper
+
 def require_permission(permission_name: str):
     """Require a specific permission for an endpoint"""
+    bit = _PERM_BITS.get(permission_name, 0)
+
     def decorator(func: Callable):
-        @wraps(func)
-        async def wrapper(
-            *args, 
-            current_user: dict = Depends(get_current_user),
-            db: Session = Depends(get_db),
-            **kwargs: Any
-        ):
+        def check(current_user: dict):
             if not current_user:
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="Authentication required"
                 )
 
-            if not user_has_permission(current_user, permission_name):
+            if not _has_permission(current_user, permission_name, bit):
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail=f"Permission '{permission_name}' required"
                 )
 
-            return await func(*args, current_user=current_user, db=db, **kwargs)
-        return wrapper
+        return _wrap(func, check)
     return decorator
 
 
@@ -98,69 +139,104 @@ from typing import Union
 def require_role(role_name: Union[str, list[str]]):
     """Require a specific role (or any of a list of roles) for an endpoint"""
     def decorator(func: Callable):
-        @wraps(func)
-        async def wrapper(
-            *args,
-            current_user: dict = Depends(get_current_user),
-            db: Session = Depends(get_db),
-            **kwargs: Any
-        ):
+        roles_to_check = role_name if isinstance(role_name, list) else [role_name]
+
+        def check(current_user: dict):
             if not current_user:
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="Authentication required"
                 )
             
-            roles_to_check = role_name if isinstance(role_name, list) else [role_name]
             if not any(user_has_role(current_user, r) for r in roles_to_check):
                 raise HTTPException(
                     status_code=status.HTTP_403_FORBIDDEN,
                     detail=f"Role '{roles_to_check}' required"
                 )
 
-            return await func(*args, current_user=current_user, db=db, **kwargs)
-        return wrapper
+        return _wrap(func, check)
     return decorator
 
 # =========================
 # RBAC Initialization
 # =========================
+# role_permissions has no unique constraint, so missing pairs are found with NOT EXISTS
+_GRANT_ROLE_PERMISSIONS_SQL = text("""
+    INSERT INTO role_permissions (role_id, permission_id)
+    SELECT r.id, p.id
+    FROM unnest(CAST(:role_names AS text[]), CAST(:perm_names AS text[])) AS d(role_name, perm_name)
+    JOIN roles r ON r.name = d.role_name
+    JOIN permissions p ON p.name = d.perm_name
+    WHERE NOT EXISTS (
+        SELECT 1 FROM role_permissions rp
+        WHERE rp.role_id = r.id AND rp.permission_id = p.id
+    )
+""")
+
 def initialize_rbac(db: Session):
     """Initialize the RBAC system with default roles and permissions"""
     # Create permissions
-    for perm_name, perm_desc in PERMISSIONS.items():
-        permission = db.query(Permission).filter(Permission.name == perm_name).first()
-        if not permission:
-            permission = Permission(name=perm_name, description=perm_desc)
-            db.add(permission)
-
-    db.commit()
-
-    # Create roles with permissions
-    for role_name, role_data in DEFAULT_ROLES.items():
-        role = db.query(Role).filter(Role.name == role_name).first()
-        if not role:
-            role = Role(
-                name=role_name,
-                description=role_data["description"],
-                is_default=(role_name == "student")
-            )
-            db.add(role)
-            db.flush()
-
-        # Assign permissions
-        for perm_name in role_data["permissions"]:
-            permission = db.query(Permission).filter(Permission.name == perm_name).first()
-            if permission and permission not in role.permissions:
-                role.permissions.append(permission)
+    db.execute(
+        insert(Permission)
+        .values([{"name": name, "description": desc} for name, desc in PERMISSIONS.items()])
+        .on_conflict_do_nothing(index_elements=["name"])
+    )
+
+    # Create roles
+    db.execute(
+        insert(Role)
+        .values([
+            {"name": name, "description": data["description"], "is_default": name == "student"}
+            for name, data in DEFAULT_ROLES.items()
+        ])
+        .on_conflict_do_nothing(index_elements=["name"])
+    )
+
+    # Assign permissions
+    pairs = [(role_name, perm_name) for role_name, data in DEFAULT_ROLES.items() for perm_name in data["permissions"]]
+    db.execute(_GRANT_ROLE_PERMISSIONS_SQL, {
+        "role_names": [role_name for role_name, _ in pairs],
+        "perm_names": [perm_name for _, perm_name in pairs],
+    })
 
     db.commit()
+    clear_role_cache()
+
+
+# Role ids by name. Roles are seeded once and rarely change, so the ids are
+# cached for the life of the process; call clear_role_cache() after editing roles.
+_ROLE_IDS: Dict[str, int] = {}
+
+def clear_role_cache() -> None:
+    """Forget cached role ids so the next lookup re-reads the roles table"""
+    _ROLE_IDS.clear()
+
+def get_role_id(db: Session, role_name: str) -> Optional[int]:
+    """Id of the named role, looked up once per process"""
+    role_id = _ROLE_IDS.get(role_name)
+    if role_id is None:
+        role_id = db.query(Role.id).filter(Role.name == role_name).scalar()
+        if role_id is not None:
+            _ROLE_IDS[role_name] = role_id
+    return role_id
+
+async def get_role_id_async(db: AsyncSession, role_name: str) -> Optional[int]:
+    """get_role_id for AsyncSession handlers (shares the same per-process cache)"""
+    role_id = _ROLE_IDS.get(role_name)
+    if role_id is None:
+        role_id = await db.scalar(select(Role.id).where(Role.name == role_name))
+        if role_id is not None:
+            _ROLE_IDS[role_name] = role_id
+    return role_id
+
+def get_role(db: Session, role_name: str) -> Optional[Role]:
+    """The named role as an ORM object, by primary key so the session's identity
+    map can answer it without a query"""
+    role_id = get_role_id(db, role_name)
+    return db.get(Role, role_id) if role_id is not None else None
 
 
 def get_user_permissions(user: User) -> List[str]:
     """Get all permissions for a user"""
-    permissions = []
-    for role in user.roles:
-        for permission in role.permissions:
-            permissions.append(permission.name)
-    return list(set(permissions))  # Remove duplicates
+    # _perm_set is deduplicated and cached on the instance
+    return list(user._perm_set)
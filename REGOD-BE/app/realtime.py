@@ -1,84 +1,110 @@
 import asyncio
-import json
 import logging
-from typing import Dict, Set, Any
+import time
+import weakref
+from typing import Dict, Any, Tuple
 from fastapi import WebSocket, WebSocketDisconnect
 import asyncpg
+import orjson
 from .database import get_db_pool
 
 logger = logging.getLogger(__name__)
 
+# Thread membership cache: entries live THREAD_MEMBERS_TTL seconds and are
+# dropped early on a chat_thread_change NOTIFY (see migrate_chat_thread_notify.sql)
+THREAD_MEMBERS_TTL = 300
+THREAD_MEMBERS_CACHE_SIZE = 10000
+
 class ConnectionManager:
     def __init__(self):
-        # Store active WebSocket connections by user_id
-        self.active_connections: Dict[str, Set[WebSocket]] = {}
-        # Store user_id by WebSocket for cleanup
-        self.websocket_to_user: Dict[WebSocket, str] = {}
+        # Store active WebSocket connections by user_id. Weak references, so a
+        # socket dropped without disconnect() doesn't leak; the owning user_id
+        # is kept on websocket.state for cleanup.
+        self.active_connections: Dict[str, "weakref.WeakSet[WebSocket]"] = {}
         # Database connection for listening to notifications
         self.db_connection = None
         self.notification_task = None
+        # thread_id -> (expires_at, member user ids)
+        self._thread_members: Dict[int, Tuple[float, Tuple[str, ...]]] = {}
 
     async def connect(self, websocket: WebSocket, user_id: str):
         await websocket.accept()
         
-        if user_id not in self.active_connections:
-            self.active_connections[user_id] = set()
-        
-        self.active_connections[user_id].add(websocket)
-        self.websocket_to_user[websocket] = user_id
+        websocket.state.user_id = user_id
+        self.active_connections.setdefault(user_id, weakref.WeakSet()).add(websocket)
         
         logger.info(f"User {user_id} connected. Total connections: {len(self.active_connections)}")
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.websocket_to_user:
-            user_id = self.websocket_to_user[websocket]
-            
-            if user_id in self.active_connections:
-                self.active_connections[user_id].discard(websocket)
-                
-                # Remove user entry if no more connections
-                if not self.active_connections[user_id]:
-                    del self.active_connections[user_id]
-            
-            del self.websocket_to_user[websocket]
-            logger.info(f"User {user_id} disconnected. Total connections: {len(self.active_connections)}")
+        user_id = getattr(websocket.state, "user_id", None)
+        sockets = self.active_connections.get(user_id)
+        if sockets is None:
+            return
+        
+        sockets.discard(websocket)
+        # Remove user entry if no more connections
+        if not sockets:
+            del self.active_connections[user_id]
+        logger.info(f"User {user_id} disconnected. Total connections: {len(self.active_connections)}")
 
     async def send_personal_message(self, message: str, user_id: str):
-        if user_id in self.active_connections:
-            dead_connections = set()
-            for websocket in self.active_connections[user_id]:
-                try:
-                    await websocket.send_text(message)
-                except Exception as e:
-                    logger.error(f"Error sending message to user {user_id}: {e}")
-                    dead_connections.add(websocket)
-            
-            # Clean up dead connections
-            for websocket in dead_connections:
+        sockets = self.active_connections.get(user_id)
+        if not sockets:
+            return
+        
+        # Send to all of the user's sockets concurrently
+        sockets = list(sockets)
+        results = await asyncio.gather(
+            *(websocket.send_text(message) for websocket in sockets),
+            return_exceptions=True
+        )
+        
+        # Clean up dead connections
+        for websocket, result in zip(sockets, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error sending message to user {user_id}: {result}")
                 self.disconnect(websocket)
 
     async def broadcast_to_thread(self, message: str, thread_id: int, exclude_user: str = None):
         """Broadcast message to all users in a chat thread"""
-        # Get all users in the thread
+        # Only members with an open socket (the sender excluded) get the message
+        targets = {
+            member for member in await self._get_thread_members(thread_id)
+            if member != exclude_user and member in self.active_connections
+        }
+        if not targets:
+            return
+        
+        # Same pre-encoded frame for every recipient, all sent at once
+        await asyncio.gather(*(self.send_personal_message(message, target_user) for target_user in targets))
+
+    async def _get_thread_members(self, thread_id: int) -> Tuple[str, ...]:
+        """User ids of a thread's student and teacher, cached for THREAD_MEMBERS_TTL"""
+        now = time.monotonic()
+        cached = self._thread_members.get(thread_id)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        
         db_pool = get_db_pool()
         async with db_pool.acquire() as conn:
-            users = await conn.fetch(
-                """
-                SELECT DISTINCT user_id, assigned_teacher_id 
-                FROM chat_threads 
-                WHERE id = $1
-                """,
+            row = await conn.fetchrow(
+                "SELECT user_id, assigned_teacher_id FROM chat_threads WHERE id = $1",
                 thread_id
             )
-            
-            for user in users:
-                user_id = str(user['user_id'])
-                teacher_id = str(user['assigned_teacher_id'])
-                
-                # Send to both student and teacher (excluding sender)
-                for target_user in [user_id, teacher_id]:
-                    if target_user and target_user != exclude_user:
-                        await self.send_personal_message(message, target_user)
+        members = tuple(str(m) for m in (row or ()) if m is not None)
+        
+        if len(self._thread_members) >= THREAD_MEMBERS_CACHE_SIZE:
+            # Evict the oldest entry (dicts keep insertion order)
+            del self._thread_members[next(iter(self._thread_members))]
+        self._thread_members[thread_id] = (now + THREAD_MEMBERS_TTL, members)
+        return members
+
+    def handle_thread_change(self, connection, pid, channel, payload):
+        """Handle PostgreSQL NOTIFY when a thread's members change"""
+        try:
+            self._thread_members.pop(int(payload), None)
+        except ValueError:
+            logger.error(f"Invalid chat_thread_change payload: {payload}")
 
     async def start_notification_listener(self):
         """Start listening to PostgreSQL notifications"""
@@ -88,6 +114,7 @@ class ConnectionManager:
             
             # Listen to chat message notifications
             await self.db_connection.add_listener('chat_message_notification', self.handle_chat_notification)
+            await self.db_connection.add_listener('chat_thread_change', self.handle_thread_change)
             
             logger.info("Started PostgreSQL notification listener")
             
@@ -97,19 +124,21 @@ class ConnectionManager:
     async def handle_chat_notification(self, connection, pid, channel, payload):
         """Handle PostgreSQL NOTIFY for chat messages"""
         try:
-            data = json.loads(payload)
+            data = orjson.loads(payload)
             thread_id = data.get('thread_id')
             message_data = data.get('message')
             sender_id = data.get('sender_id')
             
-            # Broadcast to all users in the thread
+            # Broadcast to all users in the thread. The frame is encoded once
+            # and shared by every recipient; it stays a text frame because the
+            # mobile client JSON.parses string frames.
             await self.broadcast_to_thread(
-                json.dumps({
+                orjson.dumps({
                     'type': 'new_message',
                     'thread_id': thread_id,
                     'message': message_data,
                     'sender_id': sender_id
-                }),
+                }).decode(),
                 thread_id,
                 exclude_user=sender_id
             )
@@ -121,6 +150,7 @@ class ConnectionManager:
         """Stop the notification listener and cleanup"""
         if self.db_connection:
             await self.db_connection.remove_listener('chat_message_notification', self.handle_chat_notification)
+            await self.db_connection.remove_listener('chat_thread_change', self.handle_thread_change)
             await self.db_connection.close()
             self.db_connection = None
             logger.info("Stopped PostgreSQL notification listener")
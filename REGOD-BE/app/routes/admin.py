@@ -1,123 +1,197 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from typing import List
-
-from app.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import delete, distinct, exists, func, literal, literal_column, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
+from typing import List, Optional, Tuple
+import asyncio
+import logging
+import threading
+import time
+
+from app.database import get_db, get_async_db, pool_stats
 from app.models import User, Role, Permission, TeacherAssignment, TeacherCode, user_roles, Course, role_permissions, user_permissions
-from app.schemas import RoleResponse, PermissionResponse, TeacherAssignmentResponse, UserResponse, TeacherCodeResponse, PaginatedResponse
+from app.schemas import RoleResponse, PermissionResponse, TeacherAssignmentResponse, UserResponse, TeacherCodeResponse, PaginatedResponse, BulkRoleAssignment, InviteTeacherIn, TeacherSignupIn
 from app.clerk import clerk_client
 from datetime import datetime, timedelta, timezone
-import secrets, string
 from app.utils.auth import get_current_user
-from app.rbac import require_permission, require_role
+from app.rbac import require_permission, require_role, get_role, get_role_id, get_role_id_async, clear_role_cache
 from app.utils.security import get_password_hash
-from app.utils.pagination import paginate, create_paginated_response
+from app.utils.pagination import paginate, create_paginated_response, encode_cursor, decode_cursor
+from app.routes.teacher_codes import insert_teacher_code, insert_teacher_code_async, reassign_students
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 @router.get("/users", response_model=List[UserResponse])
 @require_permission("admin:users:manage")
-async def get_all_users(
-    skip: int = 0,
-    limit: int = 100,
+def get_all_users(
+    response: Response,
+    cursor: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=100),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get all users (admin only)"""
-    users = db.query(User).offset(skip).limit(limit).all()
-    return users
+    """Get all users, newest first (admin only).
+    Pass the X-Next-Cursor response header back as ?cursor= for the next page;
+    keyset paging stays constant-time where a deep ?skip= scans and discards rows.
+    """
+    keyset = tuple_(User.created_at, User.id)
+    conditions = [keyset < decode_cursor(cursor)] if cursor else []
+    
+    roles = func.array(
+        select(Role.name)
+        .join(user_roles, Role.id == user_roles.c.role_id)
+        .where(user_roles.c.user_id == User.id)
+        .scalar_subquery()
+    )
+    # One row past the page tells whether a next page exists, from the same
+    # snapshot as the page itself
+    rows = db.execute(
+        select(
+            User.id,
+            User.email,
+            User.name,
+            User.phone,
+            User.age,
+            User.avatar_url,
+            User.church_admin_name,
+            User.home_church,
+            User.country,
+            User.city,
+            User.postal_code,
+            User.church_admin_cell_phone,
+            User.is_verified,
+            User.onboarding_completed,
+            User.created_at,
+            User.last_login,
+            roles.label("roles"),
+        )
+        .where(*conditions)
+        .order_by(User.created_at.desc(), User.id.desc())
+        .offset(0 if cursor else skip)
+        .limit(limit + 1)
+    ).mappings().all()
+    
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    
+    return [{**row, "id": str(row["id"])} for row in rows]
 
-def _generate_teacher_code(length: int = 8) -> str:
-    alphabet = string.ascii_uppercase + string.digits
-    return ''.join(secrets.choice(alphabet) for _ in range(length))
+async def _create_clerk_invitation(email: str, redirect_url: str):
+    """Create the Clerk invitation, returning None (and logging) on failure"""
+    try:
+        logger.debug("Creating Clerk invitation for %s with redirect URL: %s", email, redirect_url)
+        invitation = await clerk_client.create_invitation(
+            email_address=email, 
+            redirect_url=redirect_url
+        )
+        logger.debug("Clerk invitation created: %s", invitation)
+        return invitation
+    except Exception:
+        logger.exception("Failed to create Clerk invitation for %s", email)
+        return None
+
+async def _make_sole_teacher(db: AsyncSession, user_id) -> None:
+    """Replace all of a user's roles with the teacher role, without loading user.roles"""
+    teacher_role_id = await get_role_id_async(db, "teacher")
+    if teacher_role_id is None:
+        raise HTTPException(status_code=500, detail="Teacher role not configured")
+    await db.execute(delete(user_roles).where(user_roles.c.user_id == user_id))
+    await db.execute(user_roles.insert().values(user_id=user_id, role_id=teacher_role_id))
 
-@router.post("/teachers/invite", response_model=dict)
-@require_permission("admin:users:manage")
-async def invite_teacher(
-    payload: dict,
-    current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Invite a teacher by name+email via Clerk and prepare a teacher code.
-       Body: { name: str, email: str, max_uses?: int, expires_in_days?: int, redirect_url?: str }
-    """
-    name = payload.get("name")
-    email = payload.get("email")
-    max_uses = payload.get("max_uses", 1)
-    expires_in_days = payload.get("expires_in_days")
-    redirect_url = payload.get("redirect_url")
+async def _get_teacher_code(db: AsyncSession, teacher_code: str) -> TeacherCode:
+    """The named teacher code, or a 400 if it is unknown, expired, used up or inactive"""
+    code_rec = await db.scalar(select(TeacherCode).where(TeacherCode.code == teacher_code))
+    if not code_rec:
+        raise HTTPException(status_code=400, detail="Invalid teacher code")
+
+    # Check if code is expired
+    if code_rec.expires_at and code_rec.expires_at < datetime.now(timezone.utc):
+        raise HTTPException(status_code=400, detail="Teacher code has expired")
+
+    # Check if code has exceeded max uses
+    if code_rec.max_uses > 0 and code_rec.use_count >= code_rec.max_uses:
+        raise HTTPException(status_code=400, detail="Teacher code has exceeded maximum uses")
+
+    # Check if code is active
+    if not code_rec.is_active:
+        raise HTTPException(status_code=400, detail="Teacher code is not active")
 
-    if not name or not email:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Missing name or email")
+    return code_rec
 
+async def _create_teacher_with_code(db: AsyncSession, name: str, email: str, max_uses, expires_at) -> Tuple[User, TeacherCode]:
+    """Find or create the invited teacher locally and claim a new code for them"""
     # Ensure user exists or create locally.
-    teacher = db.query(User).filter(User.email == email).first()
+    teacher = await db.scalar(select(User).where(User.email == email))
     if not teacher:
         teacher = User(email=email, name=name, is_verified=False)
         db.add(teacher)
-        db.flush()
+        await db.flush()
 
-    # Ensure teacher role is assigned (replace any existing roles)
-    teacher_role = db.query(Role).filter(Role.name == "teacher").first()
-    if not teacher_role:
-        raise HTTPException(status_code=500, detail="Teacher role not configured")
-    
-    # Clear existing roles and assign only teacher role
-    teacher.roles.clear()
-    teacher.roles.append(teacher_role)
-
-    # Generate teacher code first
-    code = _generate_teacher_code()
-    while db.query(TeacherCode).filter(TeacherCode.code == code).first():
-        code = _generate_teacher_code()
-
-    expires_at = None
-    if expires_in_days is not None:
-        try:
-            expires_at = datetime.now(timezone.utc) + timedelta(days=int(expires_in_days))
-        except Exception:
-            pass
-
-    teacher_code = TeacherCode(
-        code=code,
+    # The code comes from the column default and is read back with RETURNING,
+    # so it is already claimed by the time the invitation carries it
+    teacher_code = await insert_teacher_code_async(
+        db,
         teacher_id=teacher.id,
         max_uses=max_uses,
         expires_at=expires_at,
     )
-    db.add(teacher_code)
-    db.commit()
-    db.refresh(teacher_code)
+    return teacher, teacher_code
+
+@router.post("/teachers/invite", response_model=dict)
+@require_permission("admin:users:manage")
+async def invite_teacher(
+    payload: InviteTeacherIn,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Invite a teacher by name+email via Clerk and prepare a teacher code.
+       Body: { name: str, email: str, max_uses?: int, expires_in_days?: int, redirect_url?: str }
+    """
+    name = payload.name
+    email = payload.email
+    max_uses = payload.max_uses
+    redirect_url = payload.redirect_url
+
+    expires_at = None
+    if payload.expires_in_days is not None:
+        expires_at = datetime.now(timezone.utc) + timedelta(days=payload.expires_in_days)
+
+    teacher, teacher_code = await _create_teacher_with_code(db, name, email, max_uses, expires_at)
+    teacher_info = {
+        "teacher_user_id": str(teacher.id),
+        "teacher_name": teacher.name,
+        "teacher_email": teacher.email,
+        "teacher_code": teacher_code.code,
+    }
 
-    # Create Clerk invitation with teacher code in redirect URL
-    invitation_redirect_url = f"{redirect_url}?teacher_code={code}"
-    invitation = None
+    # Send the Clerk invitation (which embeds the code in the redirect URL)
+    # while the role is written and the transaction commits
+    invitation_redirect_url = f"{redirect_url}?teacher_code={teacher_code.code}"
+    invitation_task = asyncio.create_task(_create_clerk_invitation(email, invitation_redirect_url))
     try:
-        print(f"Creating Clerk invitation for {email} with redirect URL: {invitation_redirect_url}")
-        invitation = clerk_client.create_invitation(
-            email_address=email, 
-            redirect_url=invitation_redirect_url
-        )
-        print(f"Clerk invitation created successfully: {invitation}")
-    except Exception as e:
-        print(f"Failed to create Clerk invitation: {e}")
-        print(f"Exception type: {type(e)}")
-        import traceback
-        traceback.print_exc()
-        invitation = None
+        # Ensure teacher role is assigned (replace any existing roles)
+        await _make_sole_teacher(db, teacher.id)
+        await db.commit()
+    except BaseException:
+        invitation_task.cancel()
+        raise
+    invitation = await invitation_task
 
     # Extract invitation URL from response
     invitation_url = None
     if invitation and isinstance(invitation, dict):
         invitation_url = invitation.get("url")
-        print(f"Extracted invitation URL: {invitation_url}")
+        logger.debug("Extracted invitation URL: %s", invitation_url)
     else:
-        print(f"Invalid invitation response: {invitation}")
+        logger.warning("Invalid invitation response: %s", invitation)
 
     return {
-        "teacher_user_id": str(teacher.id),
-        "teacher_name": teacher.name,
-        "teacher_email": teacher.email,
-        "teacher_code": teacher_code.code,
+        **teacher_info,
         "invitation_link": invitation_url,
         "debug_info": {
             "invitation_redirect_url": invitation_redirect_url,
@@ -128,7 +202,7 @@ async def invite_teacher(
 
 @router.get("/my-code", response_model=dict)
 @require_role(["admin", "teacher"])  # Admins and Teachers can have/show a code
-async def get_or_create_my_teacher_code(
+def get_or_create_my_teacher_code(
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -139,17 +213,12 @@ async def get_or_create_my_teacher_code(
     code_obj = db.query(TeacherCode).filter(TeacherCode.teacher_id == current_user["id"]).first()
     if not code_obj:
         # Generate a unique code
-        code = _generate_teacher_code()
-        while db.query(TeacherCode).filter(TeacherCode.code == code).first():
-            code = _generate_teacher_code()
-
-        code_obj = TeacherCode(
-            code=code,
+        code_obj = insert_teacher_code(
+            db,
             teacher_id=current_user["id"],
             max_uses=0,  # unlimited by default for owner; can be changed later
             expires_at=None,
         )
-        db.add(code_obj)
         db.commit()
         db.refresh(code_obj)
 
@@ -159,12 +228,12 @@ async def get_or_create_my_teacher_code(
         "is_active": code_obj.is_active,
         "use_count": code_obj.use_count,
         "max_uses": code_obj.max_uses,
-        "expires_at": code_obj.expires_at.isoformat() if code_obj.expires_at else None,
+        "expires_at": code_obj.expires_at,
     }
 
 
 @router.post("/teachers/validate-code-exists", response_model=dict)
-async def validate_teacher_code_exists(
+def validate_teacher_code_exists(
     payload: dict,
     db: Session = Depends(get_db)
 ):
@@ -202,7 +271,7 @@ async def validate_teacher_code_exists(
 @router.post("/teachers/assign-teacher-code", response_model=dict)
 async def assign_teacher_code(
     payload: dict,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Assign teacher code to an existing user.
     Body: { teacher_code, user_id }
@@ -213,73 +282,68 @@ async def assign_teacher_code(
     if not teacher_code or not user_id:
         raise HTTPException(status_code=400, detail="Missing teacher_code or user_id")
 
-    # Find the user
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
-    # Find the teacher code
-    code_rec = db.query(TeacherCode).filter(TeacherCode.code == teacher_code).first()
-    if not code_rec:
-        raise HTTPException(status_code=400, detail="Invalid teacher code")
-
-    # Check if code is expired
-    if code_rec.expires_at and code_rec.expires_at < datetime.now(timezone.utc):
-        raise HTTPException(status_code=400, detail="Teacher code has expired")
+    teacher_role_id = await get_role_id_async(db, "teacher")
+    if teacher_role_id is None:
+        raise HTTPException(status_code=500, detail="Teacher role not found in database")
 
-    # Check if code has exceeded max uses
-    if code_rec.max_uses > 0 and code_rec.use_count >= code_rec.max_uses:
-        raise HTTPException(status_code=400, detail="Teacher code has exceeded maximum uses")
+    # Find the user and whether they already have the teacher role in one query
+    row = (await db.execute(
+        select(
+            User,
+            exists().where(user_roles.c.user_id == User.id, user_roles.c.role_id == teacher_role_id).label("is_teacher")
+        ).where(User.id == user_id)
+    )).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="User not found")
+    user, is_teacher = row
 
-    # Check if code is active
-    if not code_rec.is_active:
-        raise HTTPException(status_code=400, detail="Teacher code is not active")
+    # Fetch the Clerk profile while the code is checked and the roles rewritten
+    clerk_task = asyncio.create_task(clerk_client.get_user(user.clerk_user_id)) if user.clerk_user_id else None
+    try:
+        # Find and check the teacher code
+        code_rec = await _get_teacher_code(db, teacher_code)
 
-    # Check if user already has teacher role
-    existing_teacher_role = db.query(Role).filter(Role.name == "teacher").first()
-    if existing_teacher_role and existing_teacher_role in user.roles:
-        raise HTTPException(status_code=400, detail="User already has teacher role")
+        if is_teacher:
+            raise HTTPException(status_code=400, detail="User already has teacher role")
 
-    # Assign teacher role to user
-    teacher_role = db.query(Role).filter(Role.name == "teacher").first()
-    if teacher_role:
         # Clear existing roles and assign only teacher role
-        user.roles.clear()
-        user.roles.append(teacher_role)
-        
-        # Update user name from Clerk data if available
-        try:
-            # Get user data from Clerk
-            clerk_user_data = clerk_client.get_user(user.clerk_user_id) if user.clerk_user_id else None
-            if clerk_user_data:
-                full_name = f"{clerk_user_data.get('first_name', '')} {clerk_user_data.get('last_name', '')}".strip()
-                if full_name:
-                    user.name = full_name
-        except Exception as e:
-            print(f"Could not update user name from Clerk: {e}")
-        
-        # Increment use count for the teacher code
-        code_rec.use_count += 1
-        
-        db.commit()
-        
-        return {
-            "success": True,
-            "message": "Teacher code validated successfully. You now have access to the admin portal.",
-            "user_data": {
-                "id": str(user.id),
-                "email": user.email,
-                "name": user.name,
-                "roles": [role.name for role in user.roles]
-            }
+        await _make_sole_teacher(db, user.id)
+    except BaseException:
+        if clerk_task:
+            clerk_task.cancel()
+        raise
+    
+    # Update user name from Clerk data if available
+    try:
+        # Get user data from Clerk
+        clerk_user_data = await clerk_task if clerk_task else None
+        if clerk_user_data:
+            full_name = f"{clerk_user_data.get('first_name', '')} {clerk_user_data.get('last_name', '')}".strip()
+            if full_name:
+                user.name = full_name
+    except Exception as e:
+        print(f"Could not update user name from Clerk: {e}")
+    
+    # Increment use count for the teacher code
+    code_rec.use_count += 1
+    
+    await db.commit()
+    
+    return {
+        "success": True,
+        "message": "Teacher code validated successfully. You now have access to the admin portal.",
+        "user_data": {
+            "id": str(user.id),
+            "email": user.email,
+            "name": user.name,
+            "roles": ["teacher"]
         }
-    else:
-        raise HTTPException(status_code=500, detail="Teacher role not found in database")
+    }
 
 @router.post("/teachers/validate-code", response_model=dict)
 async def validate_teacher_code(
     payload: dict,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Validate teacher code for Clerk-based signup.
     Body: { teacher_code, clerk_user_id }
@@ -290,32 +354,24 @@ async def validate_teacher_code(
     if not teacher_code or not clerk_user_id:
         raise HTTPException(status_code=400, detail="Missing teacher_code or clerk_user_id")
 
-    # Find the teacher code
-    code_rec = db.query(TeacherCode).filter(TeacherCode.code == teacher_code).first()
-    if not code_rec:
-        raise HTTPException(status_code=400, detail="Invalid teacher code")
-
-    # Check if code is expired
-    if code_rec.expires_at and code_rec.expires_at < datetime.now(timezone.utc):
-        raise HTTPException(status_code=400, detail="Teacher code has expired")
-
-    # Check if code has exceeded max uses
-    if code_rec.max_uses > 0 and code_rec.use_count >= code_rec.max_uses:
-        raise HTTPException(status_code=400, detail="Teacher code has exceeded maximum uses")
+    # The Clerk lookup only needs the Clerk ID, so it runs while the code and user are loaded
+    clerk_task = asyncio.create_task(clerk_client.get_user(clerk_user_id))
+    try:
+        # Find and check the teacher code
+        code_rec = await _get_teacher_code(db, teacher_code)
 
-    # Check if code is active
-    if not code_rec.is_active:
-        raise HTTPException(status_code=400, detail="Teacher code is not active")
-
-    # Find user by Clerk ID
-    user = db.query(User).filter(User.clerk_user_id == clerk_user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+        # Find user by Clerk ID
+        user = await db.scalar(select(User).where(User.clerk_user_id == clerk_user_id))
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+    except BaseException:
+        clerk_task.cancel()
+        raise
 
     # Update user details from Clerk if needed
     try:
         # Get fresh user data from Clerk
-        clerk_user_data = clerk_client.get_user(clerk_user_id)
+        clerk_user_data = await clerk_task
         if clerk_user_data:
             # Update user name and email from Clerk
             first_name = clerk_user_data.get('first_name', '')
@@ -355,21 +411,9 @@ async def validate_teacher_code(
         print(f"Warning: Could not fetch Clerk user data: {e}")
         # Still proceed with role assignment
 
-    # Check if user already has teacher role
-    teacher_role = db.query(Role).filter(Role.name == "teacher").first()
-    if not teacher_role:
-        raise HTTPException(status_code=500, detail="Teacher role not configured")
-
-    # For teacher signup, remove student role and assign only teacher role
-    student_role = db.query(Role).filter(Role.name == "student").first()
-    
-    # Clear existing roles and assign only teacher role
-    user.roles.clear()
-    user.roles.append(teacher_role)
-    
-    # If there was a student role, make sure it's removed from the relationship
-    if student_role and student_role in user.roles:
-        user.roles.remove(student_role)
+    # For teacher signup, clear existing roles (including student) and assign
+    # only the teacher role
+    await _make_sole_teacher(db, user.id)
 
     # Assign code to user if not already assigned
     if not code_rec.teacher_id:
@@ -378,7 +422,7 @@ async def validate_teacher_code(
     # Increment use count
     code_rec.use_count += 1
 
-    db.commit()
+    await db.commit()
 
     return {
         "message": "Teacher code validated successfully",
@@ -388,21 +432,21 @@ async def validate_teacher_code(
     }
 
 @router.post("/teachers/signup", response_model=dict)
-async def complete_teacher_signup(
-    payload: dict,
+def complete_teacher_signup(
+    payload: TeacherSignupIn,
     db: Session = Depends(get_db)
 ):
     """Complete teacher signup using email, password and teacher_code.
     Body: { name, email, password, teacher_code }
     Creates password for existing invited teacher and verifies account.
     """
-    name = payload.get("name")
-    email = payload.get("email")
-    password = payload.get("password")
-    teacher_code = payload.get("teacher_code")
+    name = payload.name
+    email = payload.email
+    password = payload.password
+    teacher_code = payload.teacher_code
 
-    if not email or not password or not teacher_code:
-        raise HTTPException(status_code=400, detail="Missing required fields")
+    # Hash before the first query so bcrypt doesn't run while holding a pooled connection
+    hashed_password = get_password_hash(password)
 
     user = db.query(User).filter(User.email == email).first()
     if not user:
@@ -417,7 +461,7 @@ async def complete_teacher_signup(
         raise HTTPException(status_code=400, detail="Invalid teacher code")
 
     # Ensure teacher role (replace any existing roles)
-    teacher_role = db.query(Role).filter(Role.name == "teacher").first()
+    teacher_role = get_role(db, "teacher")
     if not teacher_role:
         raise HTTPException(status_code=500, detail="Teacher role not configured")
     
@@ -430,7 +474,7 @@ async def complete_teacher_signup(
         code_rec.teacher_id = user.id
 
     # Set password and verify
-    user.hashed_password = get_password_hash(password)
+    user.hashed_password = hashed_password
     user.is_verified = True
     if name:
         user.name = name
@@ -441,7 +485,7 @@ async def complete_teacher_signup(
 
 @router.get("/roles")
 @require_permission("admin:users:manage")
-async def get_all_roles(
+def get_all_roles(
     page: int = Query(1, ge=1),
     items_per_page: int = Query(50, ge=1, le=100),
     current_user: dict = Depends(get_current_user),
@@ -458,15 +502,24 @@ async def get_all_roles(
             "name": role.name,
             "description": role.description,
             "is_default": role.is_default,
-            "created_at": role.created_at.isoformat() if role.created_at else None,
+            "created_at": role.created_at,
             "permissions": [p.name for p in role.permissions] if role.permissions else []
         })
     
-    return create_paginated_response(items=result, total=total, page=page, items_per_page=items_per_page, has_next=has_next, has_prev=has_prev)
+    return ORJSONResponse(create_paginated_response(items=result, total=total, page=page, items_per_page=items_per_page, has_next=has_next, has_prev=has_prev))
+
+@router.post("/roles/cache/clear")
+@require_permission("admin:users:manage")
+def clear_roles_cache(
+    current_user: dict = Depends(get_current_user)
+):
+    """Drop the cached role ids after roles are edited directly in the database (admin only)"""
+    clear_role_cache()
+    return {"message": "Role cache cleared"}
 
 @router.get("/permissions")
 @require_permission("admin:users:manage")
-async def get_all_permissions(
+def get_all_permissions(
     page: int = Query(1, ge=1),
     items_per_page: int = Query(50, ge=1, le=100),
     current_user: dict = Depends(get_current_user),
@@ -482,60 +535,117 @@ async def get_all_permissions(
             "id": perm.id,
             "name": perm.name,
             "description": perm.description,
-            "created_at": perm.created_at.isoformat() if perm.created_at else None
+            "created_at": perm.created_at
         })
     
-    return create_paginated_response(items=result, total=total, page=page, items_per_page=items_per_page, has_next=has_next, has_prev=has_prev)
+    return ORJSONResponse(create_paginated_response(items=result, total=total, page=page, items_per_page=items_per_page, has_next=has_next, has_prev=has_prev))
+
+@router.post("/users/roles:bulk")
+@require_permission("admin:users:manage")
+def bulk_assign_role(
+    payload: BulkRoleAssignment,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Assign one role to many users in a single statement (admin only)"""
+    role = db.query(Role.name).filter(Role.id == payload.role_id).first()
+    if not role:
+        raise HTTPException(status_code=404, detail="Role not found")
+    
+    # Unknown user ids and existing links are skipped by the SELECT
+    result = db.execute(
+        user_roles.insert().from_select(
+            ["user_id", "role_id"],
+            select(User.id, literal(payload.role_id)).where(
+                User.id.in_(payload.user_ids),
+                ~exists().where(user_roles.c.user_id == User.id, user_roles.c.role_id == payload.role_id)
+            )
+        )
+    )
+    db.commit()
+    
+    return {"message": f"Role '{role.name}' assigned to {result.rowcount} user(s)", "assigned": result.rowcount}
+
+@router.post("/users/roles:bulk-remove")
+@require_permission("admin:users:manage")
+def bulk_remove_role(
+    payload: BulkRoleAssignment,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Remove one role from many users in a single statement (admin only)"""
+    role = db.query(Role.name).filter(Role.id == payload.role_id).first()
+    if not role:
+        raise HTTPException(status_code=404, detail="Role not found")
+    
+    result = db.execute(
+        delete(user_roles).where(
+            user_roles.c.role_id == payload.role_id,
+            user_roles.c.user_id.in_(payload.user_ids)
+        )
+    )
+    db.commit()
+    
+    return {"message": f"Role '{role.name}' removed from {result.rowcount} user(s)", "removed": result.rowcount}
 
 @router.post("/users/{user_id}/roles/{role_id}")
 @require_permission("admin:users:manage")
-async def assign_role_to_user(
+def assign_role_to_user(
     user_id: int,
     role_id: int,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Assign a role to a user (admin only)"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = db.query(User.name).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    role = db.query(Role).filter(Role.id == role_id).first()
+    role = db.query(Role.name).filter(Role.id == role_id).first()
     if not role:
         raise HTTPException(status_code=404, detail="Role not found")
     
-    if role not in user.roles:
-        user.roles.append(role)
-        db.commit()
+    # Insert the link unless it already exists, without loading user.roles
+    db.execute(
+        user_roles.insert().from_select(
+            ["user_id", "role_id"],
+            select(User.id, Role.id).where(
+                User.id == user_id,
+                Role.id == role_id,
+                ~exists().where(user_roles.c.user_id == user_id, user_roles.c.role_id == role_id)
+            )
+        )
+    )
+    db.commit()
     
     return {"message": f"Role '{role.name}' assigned to user '{user.name}'"}
 
 @router.delete("/users/{user_id}/roles/{role_id}")
 @require_permission("admin:users:manage")
-async def remove_role_from_user(
+def remove_role_from_user(
     user_id: int,
     role_id: int,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Remove a role from a user (admin only)"""
-    user = db.query(User).filter(User.id == user_id).first()
+    user = db.query(User.name).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    role = db.query(Role).filter(Role.id == role_id).first()
+    role = db.query(Role.name).filter(Role.id == role_id).first()
     if not role:
         raise HTTPException(status_code=404, detail="Role not found")
     
-    if role in user.roles:
-        user.roles.remove(role)
-        db.commit()
+    # Delete the link directly (a no-op if it doesn't exist)
+    db.execute(delete(user_roles).where(user_roles.c.user_id == user_id, user_roles.c.role_id == role_id))
+    db.commit()
     
     return {"message": f"Role '{role.name}' removed from user '{user.name}'"}
 
 @router.delete("/users/{user_id}")
 @require_permission("admin:users:manage")
-async def delete_user_account(
+def delete_user_account(
     user_id: str,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -558,18 +668,8 @@ async def delete_user_account(
     
     if is_teacher:
         # If teacher/admin is being deleted, reassign their students to the current admin
-        # Find all active teacher assignments where this user is the teacher
-        teacher_assignments = db.query(TeacherAssignment).filter(
-            TeacherAssignment.teacher_id == user_id,
-            TeacherAssignment.active == True
-        ).all()
-        
-        # Reassign all students to the current admin (the one performing the deletion)
-        reassigned_count = 0
-        for assignment in teacher_assignments:
-            assignment.teacher_id = current_user["id"]
-            assignment.assigned_by = current_user["id"]
-            reassigned_count += 1
+        # (the one performing the deletion)
+        reassigned_count = reassign_students(db, user_id, current_user["id"])
         
         if reassigned_count > 0:
             print(f"Admin {current_user['email']} reassigned {reassigned_count} students from deleted teacher {user.email}")
@@ -588,7 +688,7 @@ async def delete_user_account(
 
 @router.get("/teacher-assignments")
 @require_permission("admin:users:manage")
-async def get_all_teacher_assignments(
+def get_all_teacher_assignments(
     page: int = Query(1, ge=1),
     items_per_page: int = Query(50, ge=1, le=100),
     current_user: dict = Depends(get_current_user),
@@ -605,129 +705,164 @@ async def get_all_teacher_assignments(
             "teacher_id": str(assignment.teacher_id),
             "student_id": str(assignment.student_id),
             "assigned_by": str(assignment.assigned_by) if assignment.assigned_by else None,
-            "assigned_at": assignment.assigned_at.isoformat() if assignment.assigned_at else None,
+            "assigned_at": assignment.assigned_at,
             "active": assignment.active
         })
     
-    return create_paginated_response(items=result, total=total, page=page, items_per_page=items_per_page, has_next=has_next, has_prev=has_prev)
+    return ORJSONResponse(create_paginated_response(items=result, total=total, page=page, items_per_page=items_per_page, has_next=has_next, has_prev=has_prev))
 
 @router.post("/teacher-assignments")
 @require_permission("admin:users:manage")
-async def create_teacher_assignment(
+def create_teacher_assignment(
     assignment_data: TeacherAssignmentResponse,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Create a teacher assignment (admin only)"""
-    # Check if teacher exists and has teacher role
-    teacher = db.query(User).filter(User.id == assignment_data.teacher_id).first()
-    if not teacher or not teacher.has_role("teacher"):
+    # Teacher role and student existence checked together in one round-trip
+    # (a missing teacher has no roles)
+    teacher_role_id = get_role_id(db, "teacher")
+    is_teacher, student_exists = db.execute(
+        select(
+            exists().where(
+                user_roles.c.user_id == assignment_data.teacher_id,
+                user_roles.c.role_id == teacher_role_id
+            ),
+            exists().where(User.id == assignment_data.student_id)
+        )
+    ).one()
+    if teacher_role_id is None or not is_teacher:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid teacher ID"
         )
-    
-    # Check if student exists
-    student = db.query(User).filter(User.id == assignment_data.student_id).first()
-    if not student:
+    if not student_exists:
         raise HTTPException(status_code=404, detail="Student not found")
     
-    # Check if assignment already exists
-    existing_assignment = db.query(TeacherAssignment).filter(
-        TeacherAssignment.teacher_id == assignment_data.teacher_id,
-        TeacherAssignment.student_id == assignment_data.student_id
-    ).first()
-    
-    if existing_assignment:
-        if not existing_assignment.active:
-            existing_assignment.active = True
-            existing_assignment.assigned_by = current_user["id"]
-            db.commit()
-            return {"message": "Teacher assignment reactivated"}
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Teacher assignment already exists"
-            )
-    
-    # Create new assignment
-    assignment = TeacherAssignment(
+    # Create the assignment, or reactivate an inactive one, in one statement.
+    # An already-active assignment is left alone and returns no row; xmax = 0
+    # only for a freshly inserted row.
+    stmt = insert(TeacherAssignment).values(
         teacher_id=assignment_data.teacher_id,
         student_id=assignment_data.student_id,
-        assigned_by=current_user["id"]
+        assigned_by=current_user["id"],
+        active=True
     )
-    
-    db.add(assignment)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[TeacherAssignment.teacher_id, TeacherAssignment.student_id],
+        set_={"active": True, "assigned_by": stmt.excluded.assigned_by},
+        where=TeacherAssignment.active == False
+    ).returning(literal_column("xmax = 0").label("inserted"))
+    
+    upserted = db.execute(stmt).first()
+    if upserted is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Teacher assignment already exists"
+        )
     db.commit()
     
+    if not upserted.inserted:
+        return {"message": "Teacher assignment reactivated"}
     return {"message": "Teacher assignment created successfully"}
 
 @router.delete("/teacher-assignments/{assignment_id}")
 @require_permission("admin:users:manage")
-async def delete_teacher_assignment(
+def delete_teacher_assignment(
     assignment_id: int,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Delete a teacher assignment (admin only)"""
-    assignment = db.query(TeacherAssignment).filter(TeacherAssignment.id == assignment_id).first()
-    if not assignment:
+    result = db.execute(delete(TeacherAssignment).where(TeacherAssignment.id == assignment_id))
+    if result.rowcount == 0:
         raise HTTPException(status_code=404, detail="Assignment not found")
     
-    db.delete(assignment)
     db.commit()
     
     return {"message": "Teacher assignment deleted successfully"}
 
 @router.get("/teacher-codes")
 @require_permission("admin:users:manage")
-async def get_all_teacher_codes(
+def get_all_teacher_codes(
     page: int = Query(1, ge=1),
     items_per_page: int = Query(50, ge=1, le=100),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get all teacher codes with pagination (admin only)"""
-    query = db.query(TeacherCode)
+    # Teachers come back in the same query instead of one lookup per code
+    query = db.query(TeacherCode).options(joinedload(TeacherCode.teacher))
     items, total, page, items_per_page, has_next, has_prev = paginate(query, page, items_per_page)
     
     response = []
     for code in items:
-        teacher = db.query(User).filter(User.id == code.teacher_id).first()
+        teacher = code.teacher
         response.append({
             "id": code.id,
             "code": code.code,
             "teacher_id": str(code.teacher_id),
             "teacher_name": teacher.name if teacher else "Unknown Teacher",
-            "created_at": code.created_at.isoformat() if code.created_at else None,
+            "created_at": code.created_at,
             "max_uses": code.max_uses,
-            "expires_at": code.expires_at.isoformat() if code.expires_at else None,
+            "expires_at": code.expires_at,
             "use_count": code.use_count,
             "is_active": code.is_active
         })
     
-    return create_paginated_response(items=response, total=total, page=page, items_per_page=items_per_page, has_next=has_next, has_prev=has_prev)
+    return ORJSONResponse(create_paginated_response(items=response, total=total, page=page, items_per_page=items_per_page, has_next=has_next, has_prev=has_prev))
+
+# /stats is polled by admin dashboards; serve the same counts to every poll
+# within STATS_TTL seconds. The lock keeps concurrent misses to one query.
+STATS_TTL = 15
+_stats_cache: Optional[Tuple[float, dict]] = None
+_stats_lock = threading.Lock()
 
 @router.get("/stats")
 @require_permission("admin:users:manage")
-async def get_admin_stats(
+def get_admin_stats(
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """Get admin statistics"""
-    # Count total users
-    total_users = db.query(User).count()
-    
-    # Count teachers
-    teacher_role = db.query(Role).filter(Role.name == "teacher").first()
-    total_teachers = db.query(User).join(user_roles, User.id == user_roles.c.user_id).filter(user_roles.c.role_id == teacher_role.id).count() if teacher_role else 0
-    
-    # Count students (users with 'user' role)
-    user_role = db.query(Role).filter(Role.name == "user").first()
-    total_students = db.query(User).join(user_roles, User.id == user_roles.c.user_id).filter(user_roles.c.role_id == user_role.id).count() if user_role else 0
-    
-    # Count courses
-    total_courses = db.query(Course).count()
+    """Get admin statistics (counts cached for STATS_TTL seconds, pool gauges live)"""
+    return {**_cached_admin_stats(db), "db_pool": pool_stats()}
+
+def _cached_admin_stats(db: Session) -> dict:
+    global _stats_cache
+    cached = _stats_cache
+    if cached is not None and time.monotonic() < cached[0]:
+        return cached[1]
+    
+    with _stats_lock:
+        # Another request may have refreshed the cache while we waited
+        cached = _stats_cache
+        if cached is not None and time.monotonic() < cached[0]:
+            return cached[1]
+        stats = _compute_admin_stats(db)
+        _stats_cache = (time.monotonic() + STATS_TTL, stats)
+        return stats
+
+def _compute_admin_stats(db: Session) -> dict:
+    """Count users, teachers, students and courses"""
+    # All counts in one round-trip: role counts are conditional aggregates over
+    # user_roles, user and course totals are scalar subqueries. Filtering on the
+    # cached role ids (no join to roles) lets ix_user_roles_role_user serve the
+    # role counts from just those two roles' index entries.
+    teacher_role_id = get_role_id(db, "teacher")
+    # Students are counted as users with the 'user' role
+    student_role_id = get_role_id(db, "user")
+    role_user = distinct(user_roles.c.user_id)
+    stats = db.execute(
+        select(
+            select(func.count()).select_from(User).scalar_subquery().label("total_users"),
+            func.count(role_user).filter(user_roles.c.role_id == teacher_role_id).label("total_teachers"),
+            func.count(role_user).filter(user_roles.c.role_id == student_role_id).label("total_students"),
+            select(func.count()).select_from(Course).scalar_subquery().label("total_courses"),
+        ).select_from(user_roles).where(
+            user_roles.c.role_id.in_([r for r in (teacher_role_id, student_role_id) if r is not None])
+        )
+    ).one()
+    total_users, total_teachers, total_students, total_courses = stats
     
     return {
         "total_users": total_users,
@@ -738,7 +873,7 @@ async def get_admin_stats(
 
 @router.get("/teacher-stats")
 @require_role(["teacher", "admin"])
-async def get_teacher_stats(
+def get_teacher_stats(
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -759,14 +894,15 @@ async def get_teacher_stats(
 
 @router.get("/my-students")
 @require_role(["teacher", "admin"])
-async def get_my_students(
+def get_my_students(
     page: int = Query(1, ge=1),
     items_per_page: int = Query(50, ge=1, le=100),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get students assigned to this teacher with pagination"""
-    query = db.query(TeacherAssignment).filter(
+    # Students come back in the same query instead of one lookup per assignment
+    query = db.query(TeacherAssignment).options(joinedload(TeacherAssignment.student)).filter(
         TeacherAssignment.teacher_id == current_user["id"],
         TeacherAssignment.active == True
     )
@@ -775,96 +911,96 @@ async def get_my_students(
     
     students = []
     for assignment in items:
-        student = db.query(User).filter(User.id == assignment.student_id).first()
+        student = assignment.student
         if student:
             students.append({
                 "id": str(student.id),
                 "name": student.name,
                 "email": student.email,
-                "assigned_at": assignment.assigned_at.isoformat()
+                "assigned_at": assignment.assigned_at
             })
     
-    return create_paginated_response(items=students, total=total, page=page, items_per_page=items_per_page, has_next=has_next, has_prev=has_prev)
+    return ORJSONResponse(create_paginated_response(items=students, total=total, page=page, items_per_page=items_per_page, has_next=has_next, has_prev=has_prev))
 
 @router.get("/teachers")
 @require_permission("admin:users:manage")
-async def get_teachers_directory(
+def get_teachers_directory(
     page: int = Query(1, ge=1),
     items_per_page: int = Query(50, ge=1, le=100),
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Get all teachers with pagination (excluding users who also have admin role)"""
-    teacher_role = db.query(Role).filter(Role.name == "teacher").first()
-    admin_role = db.query(Role).filter(Role.name == "admin").first()
-    
-    if not teacher_role:
-        return create_paginated_response(items=[], total=0, page=page, items_per_page=items_per_page, has_next=False, has_prev=False)
-    
-    # Get all teachers (filter out inactive users)
-    teachers_query = db.query(User).join(user_roles, User.id == user_roles.c.user_id).filter(
-        user_roles.c.role_id == teacher_role.id,
+    teacher_role_id = get_role_id(db, "teacher")
+    admin_role_id = get_role_id(db, "admin")
+    
+    if teacher_role_id is None:
+        return ORJSONResponse(create_paginated_response(items=[], total=0, page=page, items_per_page=items_per_page, has_next=False, has_prev=False))
+    
+    upload_perm_id = db.query(Permission.id).filter(Permission.name == "content:upload").scalar_subquery()
+    teacher_code = (
+        select(TeacherCode.code)
+        .where(TeacherCode.teacher_id == User.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    # Role-based or user-specific content:upload grant; user_roles is aliased so the
+    # subqueries don't correlate against the outer teacher join
+    granted_roles = user_roles.alias()
+    role_upload = exists().where(
+        granted_roles.c.user_id == User.id,
+        role_permissions.c.role_id == granted_roles.c.role_id,
+        role_permissions.c.permission_id == upload_perm_id,
+    )
+    user_upload = exists().where(
+        user_permissions.c.user_id == User.id,
+        user_permissions.c.permission_id == upload_perm_id,
+    )
+
+    # Only the listed columns are fetched, so rows come back as plain tuples
+    teachers_query = db.query(
+        User.id,
+        User.name,
+        User.email,
+        User.avatar_url,
+        User.created_at,
+        User.is_active,
+        teacher_code.label("teacher_code"),
+        (role_upload | user_upload).label("can_upload"),
+    ).join(user_roles, User.id == user_roles.c.user_id).filter(
+        user_roles.c.role_id == teacher_role_id,
         User.is_active == True  # Only show active teachers
     )
     
     # Filter out users who also have admin role
-    if admin_role:
-        # Get user IDs who have admin role
-        admin_user_ids = db.query(user_roles.c.user_id).filter(user_roles.c.role_id == admin_role.id).all()
-        admin_user_id_set = {user_id[0] for user_id in admin_user_ids}
-        
-        # Exclude admin users from teacher list
-        teachers_query = teachers_query.filter(~User.id.in_(admin_user_id_set))
+    if admin_role_id is not None:
+        admin_roles = user_roles.alias()
+        teachers_query = teachers_query.filter(
+            ~exists().where(admin_roles.c.user_id == User.id, admin_roles.c.role_id == admin_role_id)
+        )
     
     # Apply pagination
     items, total, page, items_per_page, has_next, has_prev = paginate(teachers_query, page, items_per_page)
     
-    # Get content:upload permission ID for checking
-    content_upload_perm = db.query(Permission).filter(Permission.name == "content:upload").first()
-    
-    result = []
-    for teacher in items:
-        # Get teacher code if exists
-        teacher_code_obj = db.query(TeacherCode).filter(TeacherCode.teacher_id == teacher.id).first()
-        teacher_code = teacher_code_obj.code if teacher_code_obj else None
-        
-        # Check if teacher has content:upload permission (check both role and user-specific permissions)
-        has_upload_permission = False
-        if content_upload_perm:
-            # Check role-based permissions
-            for role in teacher.roles:
-                perm_exists = db.query(role_permissions).filter(
-                    role_permissions.c.role_id == role.id,
-                    role_permissions.c.permission_id == content_upload_perm.id
-                ).first() is not None
-                if perm_exists:
-                    has_upload_permission = True
-                    break
-            
-            # Check user-specific permissions (override role permissions)
-            if not has_upload_permission:
-                user_perm_exists = db.query(user_permissions).filter(
-                    user_permissions.c.user_id == teacher.id,
-                    user_permissions.c.permission_id == content_upload_perm.id
-                ).first() is not None
-                has_upload_permission = user_perm_exists
-        
-        result.append({
-            "id": str(teacher.id),
-            "name": teacher.name,
-            "email": teacher.email,
-            "avatar_url": teacher.avatar_url,
-            "created_at": teacher.created_at.isoformat() if teacher.created_at else None,
-            "is_active": teacher.is_active,
-            "teacher_code": teacher_code,
-            "can_upload": has_upload_permission
-        })
+    result = [
+        {
+            "id": str(row.id),
+            "name": row.name,
+            "email": row.email,
+            "avatar_url": row.avatar_url,
+            "created_at": row.created_at,
+            "is_active": row.is_active,
+            "teacher_code": row.teacher_code,
+            "can_upload": bool(row.can_upload)
+        }
+        for row in items
+    ]
     
-    return create_paginated_response(items=result, total=total, page=page, items_per_page=items_per_page, has_next=has_next, has_prev=has_prev)
+    return ORJSONResponse(create_paginated_response(items=result, total=total, page=page, items_per_page=items_per_page, has_next=has_next, has_prev=has_prev))
 
 @router.get("/students")
 @require_role(["admin", "teacher"])
-async def get_students_directory(
+def get_students_directory(
     page: int = Query(1, ge=1),
     items_per_page: int = Query(50, ge=1, le=100),
     current_user: dict = Depends(get_current_user),
@@ -879,35 +1015,31 @@ async def get_students_directory(
     
     if is_admin:
         # Admin sees all students
-        teacher_role = db.query(Role).filter(Role.name == "teacher").first()
-        admin_role = db.query(Role).filter(Role.name == "admin").first()
-        
-        role_ids_to_exclude = []
-        if teacher_role:
-            role_ids_to_exclude.append(teacher_role.id)
-        if admin_role:
-            role_ids_to_exclude.append(admin_role.id)
+        role_ids_to_exclude = [
+            role_id for role_id in (get_role_id(db, "teacher"), get_role_id(db, "admin"))
+            if role_id is not None
+        ]
         
         if role_ids_to_exclude:
+            # NOT EXISTS plans as an anti-join probing ix_user_roles_user_role
             query = db.query(User).filter(
-                ~User.id.in_(
-                    db.query(user_roles.c.user_id).filter(
-                        user_roles.c.role_id.in_(role_ids_to_exclude)
-                    )
+                ~exists().where(
+                    user_roles.c.user_id == User.id,
+                    user_roles.c.role_id.in_(role_ids_to_exclude)
                 ),
                 User.is_active == True
             )
         else:
             query = db.query(User).filter(User.is_active == True)
     else:
-        # Teacher sees only their assigned students
-        assignments = db.query(TeacherAssignment).filter(
-            TeacherAssignment.teacher_id == current_user["id"],
-            TeacherAssignment.active == True
-        ).all()
-        
-        student_ids = [assignment.student_id for assignment in assignments]
-        query = db.query(User).filter(User.id.in_(student_ids))
+        # Teacher sees only their assigned students (semi-join, no id list round-trip)
+        query = db.query(User).filter(
+            exists().where(
+                TeacherAssignment.student_id == User.id,
+                TeacherAssignment.teacher_id == current_user["id"],
+                TeacherAssignment.active == True
+            )
+        )
     
     # Apply pagination
     items, total, page, items_per_page, has_next, has_prev = paginate(query, page, items_per_page)
@@ -950,7 +1082,7 @@ async def get_students_directory(
             "email": student.email,
             "phone": student.phone,
             "avatar_url": student.avatar_url,
-            "created_at": student.created_at.isoformat() if student.created_at else None,
+            "created_at": student.created_at,
             "is_active": student.is_active,
             "enrolled_courses": course_count,
             "teacher_id": teacher_id,
@@ -958,11 +1090,11 @@ async def get_students_directory(
             "teacher_code": teacher_code
         })
     
-    return create_paginated_response(items=result, total=total, page=page, items_per_page=items_per_page, has_next=has_next, has_prev=has_prev)
+    return ORJSONResponse(create_paginated_response(items=result, total=total, page=page, items_per_page=items_per_page, has_next=has_next, has_prev=has_prev))
 
 @router.put("/students/{student_id}/teacher")
 @require_permission("admin:users:manage")
-async def update_student_teacher(
+def update_student_teacher(
     student_id: str,
     payload: dict,
     current_user: dict = Depends(get_current_user),
@@ -987,28 +1119,20 @@ async def update_student_teacher(
         raise HTTPException(status_code=404, detail="Teacher not found")
     
     # Check if user has teacher role
-    teacher_role = db.query(Role).filter(Role.name == "teacher").first()
-    has_teacher_role = False
-    if teacher_role:
-        has_teacher_role = teacher_role in teacher.roles
+    has_teacher_role = teacher.has_role("teacher")
     
     # Allow admin users as well
-    admin_role = db.query(Role).filter(Role.name == "admin").first()
-    has_admin_role = False
-    if admin_role:
-        has_admin_role = admin_role in teacher.roles
+    has_admin_role = teacher.has_role("admin")
     
     if not has_teacher_role and not has_admin_role:
         raise HTTPException(status_code=400, detail="Specified user is not a teacher or admin")
     
     # Deactivate existing active assignments for this student
-    existing_assignments = db.query(TeacherAssignment).filter(
-        TeacherAssignment.student_id == uuid.UUID(student_id),
-        TeacherAssignment.active == True
-    ).all()
-    
-    for assignment in existing_assignments:
-        assignment.active = False
+    db.execute(
+        update(TeacherAssignment)
+        .where(TeacherAssignment.student_id == uuid.UUID(student_id), TeacherAssignment.active == True)
+        .values(active=False)
+    )
     
     # Create or reactivate assignment with new teacher
     existing_assignment = db.query(TeacherAssignment).filter(
@@ -1064,7 +1188,7 @@ async def update_student_teacher(
 
 @router.put("/teachers/{teacher_id}/permissions/upload")
 @require_permission("admin:users:manage")
-async def toggle_teacher_upload_permission(
+def toggle_teacher_upload_permission(
     teacher_id: str,
     payload: dict,
     current_user: dict = Depends(get_current_user),
@@ -1080,10 +1204,7 @@ async def toggle_teacher_upload_permission(
         raise HTTPException(status_code=404, detail="Teacher not found")
     
     # Check if user has teacher role
-    teacher_role = db.query(Role).filter(Role.name == "teacher").first()
-    has_teacher_role = False
-    if teacher_role:
-        has_teacher_role = teacher_role in teacher.roles
+    has_teacher_role = teacher.has_role("teacher")
     
     if not has_teacher_role:
         raise HTTPException(status_code=400, detail="Specified user is not a teacher")
@@ -1097,8 +1218,7 @@ async def toggle_teacher_upload_permission(
     enabled = payload.get("enabled", True)
     
     # Check if teacher already has admin role
-    admin_role = db.query(Role).filter(Role.name == "admin").first()
-    has_admin_role = admin_role and admin_role in teacher.roles
+    has_admin_role = teacher.has_role("admin")
     
     if has_admin_role:
         return {
@@ -1156,7 +1276,7 @@ async def toggle_teacher_upload_permission(
 
 @router.get("/students/{student_id}/analytics")
 @require_role(["admin", "teacher"])
-async def get_student_analytics(
+def get_student_analytics(
     student_id: str,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -1187,41 +1307,42 @@ async def get_student_analytics(
         if not assignment:
             raise HTTPException(status_code=403, detail="You don't have permission to view this student's analytics")
     
-    # Get course progress
-    course_progress = db.query(UserCourseProgress).filter(
-        UserCourseProgress.user_id == student.id
-    ).all()
+    # Aggregate progress in the database instead of loading every progress and
+    # quiz row: course figures come from user_course_progress, lesson and quiz
+    # counts from scalar subqueries in the same statement
+    progress = db.execute(
+        select(
+            func.count().label("total_courses"),
+            func.count().filter(UserCourseProgress.progress_percentage >= 100).label("completed_courses"),
+            func.coalesce(func.avg(UserCourseProgress.progress_percentage), 0).label("avg_course_progress"),
+            # Approximate time spent from each course's first to last visit
+            func.coalesce(
+                func.sum(func.extract("epoch", UserCourseProgress.last_visited_at - UserCourseProgress.started_at)), 0
+            ).label("seconds_spent"),
+            select(func.count()).select_from(UserModuleProgress)
+                .where(UserModuleProgress.user_id == student.id)
+                .scalar_subquery().label("total_lessons"),
+            select(func.count()).select_from(UserModuleProgress)
+                .where(UserModuleProgress.user_id == student.id, UserModuleProgress.status == "completed")
+                .scalar_subquery().label("completed_lessons"),
+            select(func.count(distinct(tuple_(QuizResponse.course_id, QuizResponse.module_id))))
+                .where(QuizResponse.user_id == student.id)
+                .scalar_subquery().label("total_quizzes"),
+        ).where(UserCourseProgress.user_id == student.id)
+    ).one()
     
     # Calculate total courses enrolled and completed
-    total_courses = len(course_progress)
-    completed_courses = sum(1 for cp in course_progress if cp.progress_percentage >= 100)
-    total_course_progress = sum(cp.progress_percentage for cp in course_progress) / total_courses if total_courses > 0 else 0
-    
-    # Get lesson/module progress
-    module_progress = db.query(UserModuleProgress).filter(
-        UserModuleProgress.user_id == student.id
-    ).all()
+    total_courses = progress.total_courses
+    completed_courses = progress.completed_courses
+    total_course_progress = float(progress.avg_course_progress)
     
-    total_lessons = len(module_progress)
-    completed_lessons = sum(1 for mp in module_progress if mp.status == "completed")
+    total_lessons = progress.total_lessons
+    completed_lessons = progress.completed_lessons
     total_lesson_progress = (completed_lessons / total_lessons * 100) if total_lessons > 0 else 0
     
-    # Get quiz responses
-    quiz_responses = db.query(QuizResponse).filter(
-        QuizResponse.user_id == student.id
-    ).all()
-    
-    total_quizzes = len(set((qr.course_id, qr.module_id) for qr in quiz_responses))
+    total_quizzes = progress.total_quizzes
     
-    # Get total time spent (approximate based on sessions)
-    # For now, we'll estimate based on last_visited_at timestamps
-    time_spent_hours = 0.0
-    if course_progress:
-        # Calculate approximate time based on activity
-        for cp in course_progress:
-            if cp.started_at and cp.last_visited_at:
-                delta = cp.last_visited_at - cp.started_at
-                time_spent_hours += delta.total_seconds() / 3600
+    time_spent_hours = float(progress.seconds_spent) / 3600
     
     # Limit to reasonable value
     time_spent_hours = min(time_spent_hours, 1000)
@@ -1269,7 +1390,7 @@ async def get_student_analytics(
             "email": student.email,
             "phone": student.phone,
             "avatar_url": student.avatar_url,
-            "created_at": student.created_at.isoformat() if student.created_at else None
+            "created_at": student.created_at
         },
         "stats": {
             "time_spent_hours": round(time_spent_hours, 1),
@@ -7,7 +7,7 @@ from app.database import get_db
 from app.models import User
 from app.schemas import UserResponse
 from app.utils.auth import get_current_user, create_access_token, create_refresh_token
-from app.rbac import require_permission
+from app.rbac import require_permission, get_role, get_role_id
 from app.clerk import clerk_client
 
 router = APIRouter()
@@ -63,8 +63,7 @@ async def clerk_exchange(
             db.refresh(user)
             
             # Assign default student role
-            from app.models import Role
-            student_role = db.query(Role).filter(Role.name == "student").first()
+            student_role = get_role(db, "student")
             if student_role:
                 user.roles.append(student_role)
                 db.commit()
@@ -216,8 +215,7 @@ async def register_user(
             db.refresh(user)
             
             # Assign default student role
-            from app.models import Role
-            student_role = db.query(Role).filter(Role.name == "student").first()
+            student_role = get_role(db, "student")
             if student_role:
                 user.roles.append(student_role)
         else:
@@ -247,12 +245,12 @@ async def register_user(
             db.add(assignment)
         else:
             # No teacher code provided - auto-assign to first admin
-            from app.models import TeacherAssignment, Role
-            admin_role = db.query(Role).filter(Role.name == "admin").first()
-            if admin_role:
+            from app.models import TeacherAssignment
+            admin_role_id = get_role_id(db, "admin")
+            if admin_role_id is not None:
                 # Get first admin user
                 admin_user = db.query(User).join(user_roles).filter(
-                    user_roles.c.role_id == admin_role.id
+                    user_roles.c.role_id == admin_role_id
                 ).first()
                 
                 if admin_user:
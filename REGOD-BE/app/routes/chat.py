@@ -1,7 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, Query
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from typing import List
-import json
+import asyncio
+import logging
+import orjson
 import uuid
 from datetime import datetime
 
@@ -15,10 +18,25 @@ from app.queue_service import pgmq_service
 from app.utils.pagination import paginate, create_paginated_response
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-# Store active WebSocket connections
+# Outgoing event queue per connected user; a writer task per socket drains it
 active_connections = {}
 
+# Most queued events coalesced into a single WebSocket frame (clients that
+# connect with ?batch=1 accept JSON array frames; others get one event per frame)
+WS_BATCH_MAX = 32
+
+# Outgoing events buffered per connection; past this a slow reader loses events
+WS_QUEUE_MAX = 256
+
+# Most incoming messages handled concurrently per connection
+WS_MAX_INFLIGHT = 16
+
+# Constant parts of the new_message event envelope
+_NEW_MESSAGE_PREFIX = b'{"type":"new_message","message":'
+_THREAD_ID_KEY = b',"thread_id":'
+
 @router.get("/thread", response_model=ThreadResponse)
 async def get_or_create_thread(
     current_user: dict = Depends(get_current_user),
@@ -298,38 +316,23 @@ async def send_message(
     try:
         if current_user.get("role") == "student":
             # Student sent message - notify teacher
-            if thread.assigned_teacher_id and str(thread.assigned_teacher_id) in active_connections:
-                teacher_ws = active_connections[str(thread.assigned_teacher_id)]
-                await teacher_ws.send_text(json.dumps({
-                    'type': 'new_message',
-                    'message': {
-                        'id': str(new_message.id),
-                        'content': new_message.content,
-                        'sender_id': str(new_message.sender_id),
-                        'sender_name': current_user.get("name", "User"),
-                        'timestamp': new_message.timestamp.isoformat(),
-                        'message_type': new_message.message_type
-                    },
-                    'thread_id': thread.id
-                }))
+            recipient_queue = active_connections.get(str(thread.assigned_teacher_id)) if thread.assigned_teacher_id else None
         else:
             # Teacher sent message - notify student
-            if str(thread.user_id) in active_connections:
-                student_ws = active_connections[str(thread.user_id)]
-                await student_ws.send_text(json.dumps({
-                    'type': 'new_message',
-                    'message': {
-                        'id': str(new_message.id),
-                        'content': new_message.content,
-                        'sender_id': str(new_message.sender_id),
-                        'sender_name': current_user.get("name", "User"),
-                        'timestamp': new_message.timestamp.isoformat(),
-                        'message_type': new_message.message_type
-                    },
-                    'thread_id': thread.id
-                }))
+            recipient_queue = active_connections.get(str(thread.user_id))
+        if recipient_queue is not None:
+            recipient_queue.put_nowait(_new_message_event({
+                'id': str(new_message.id),
+                'content': new_message.content,
+                'sender_id': str(new_message.sender_id),
+                'sender_name': current_user.get("name", "User"),
+                'timestamp': new_message.timestamp.isoformat(),
+                'message_type': new_message.message_type
+            }, thread.id))
+    except asyncio.QueueFull:
+        logger.warning("[WebSocket] Recipient's outgoing queue is full, dropping new_message event")
     except Exception as e:
-        print(f"Error sending WebSocket notification: {e}")
+        logger.warning("[WebSocket] Error sending notification: %s", e)
     
     # Send PGMQ notification for offline users
     try:
@@ -348,7 +351,7 @@ async def send_message(
                 'timestamp': new_message.timestamp.isoformat()
             })
     except Exception as e:
-        print(f"Error sending PGMQ notification: {e}")
+        logger.warning("Error sending PGMQ notification: %s", e)
     
     return MessageResponse(
         id=new_message.id,
@@ -362,60 +365,111 @@ async def send_message(
         read_status=new_message.read_status
     )
 
+def _new_message_event(message: dict, thread_id) -> bytes:
+    """Encode a new_message event; the envelope around the payload is fixed bytes"""
+    return _NEW_MESSAGE_PREFIX + orjson.dumps(message) + _THREAD_ID_KEY + orjson.dumps(thread_id) + b"}"
+
+async def _drain(websocket: WebSocket, queue: asyncio.Queue, batch: bool):
+    """Write queued (already encoded) events to the socket. With batch, whatever
+    is already waiting is coalesced into one JSON array frame."""
+    try:
+        while True:
+            events = [await queue.get()]
+            while batch and len(events) < WS_BATCH_MAX:
+                try:
+                    events.append(queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            # Sent as text frames since the mobile client JSON.parses string frames
+            frame = events[0] if len(events) == 1 else b"[" + b",".join(events) + b"]"
+            await websocket.send_text(frame.decode())
+    except Exception as e:
+        # Close the socket so the receive loop ends and the connection is
+        # dropped, instead of events piling up behind a dead writer
+        logger.warning("[WebSocket] Writer failed, closing socket: %s", e)
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+async def _handle_ws_message(user_id: str, queue: asyncio.Queue, data: str):
+    """Process one message received on a user's socket"""
+    try:
+        message_data = orjson.loads(data)
+    except orjson.JSONDecodeError as json_error:
+        logger.debug("[WebSocket] Invalid JSON received: %s, error: %s", data, json_error)
+        return
+
+    # Handle different message types
+    if message_data.get("type") == "typing":
+        # Broadcast typing indicator
+        pass
+
 @router.websocket("/socket")
 async def websocket_endpoint(
     websocket: WebSocket,
     token: str,
+    batch: bool = False,
     db: Session = Depends(get_db)
 ):
-    """WebSocket endpoint for real-time chat"""
-    print(f"[WebSocket] Connection attempt with token: {token[:50]}...")
+    """WebSocket endpoint for real-time chat.
+    Pass ?batch=1 to receive bursts of events as a single JSON array frame.
+    """
+    user_id_str = None
+    writer = None
+    queue = None
+    pending = set()
     try:
         # Authenticate user
         user = await get_current_user_from_token(token, db)
-        print(f"[WebSocket] Authentication successful for user: {user.id}")
+        user_id_str = str(user.id)
+        # The socket outlives the auth query; end its transaction and hand the
+        # connection back now instead of leaving it idle in transaction
+        await run_in_threadpool(db.close)
         
         await websocket.accept()
-        print(f"[WebSocket] Connection accepted for user: {user.id}")
-        active_connections[str(user.id)] = websocket
+        logger.debug("[WebSocket] Connection accepted for user: %s", user_id_str)
+        queue = asyncio.Queue(maxsize=WS_QUEUE_MAX)
+        writer = asyncio.create_task(_drain(websocket, queue, batch))
+        active_connections[user_id_str] = queue
         
-        try:
-            while True:
-                data = await websocket.receive_text()
-                try:
-                    message_data = json.loads(data)
-                except json.JSONDecodeError as json_error:
-                    print(f"[WebSocket] Invalid JSON received: {data}, error: {json_error}")
-                    continue
+        # Incoming messages are handled concurrently so a slow one doesn't hold
+        # up the next. The semaphore caps how many run at once per socket; once
+        # it is exhausted we stop reading, which pushes back on the client.
+        sem = asyncio.Semaphore(WS_MAX_INFLIGHT)
+
+        async def handle(data: str):
+            try:
+                await _handle_ws_message(user_id_str, queue, data)
+            finally:
+                sem.release()
+
+        while True:
+            data = await websocket.receive_text()
+            await sem.acquire()
+            task = asyncio.create_task(handle(data))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
                 
-                # Handle different message types
-                if message_data.get("type") == "typing":
-                    # Broadcast typing indicator
-                    pass
-                    
-        except WebSocketDisconnect:
-            # Safely remove connection if it exists
-            user_id_str = str(user.id)
-            if user_id_str in active_connections:
-                del active_connections[user_id_str]
-                print(f"[WebSocket] Removed connection for user: {user_id_str}")
-            
+    except WebSocketDisconnect:
+        # The socket is already closed on disconnect
+        logger.debug("[WebSocket] Disconnected user: %s", user_id_str)
     except Exception as e:
-        print(f"[WebSocket] Error: {type(e).__name__}: {str(e)}")
-        import traceback
-        print(f"[WebSocket] Traceback: {traceback.format_exc()}")
-        
-        # Clean up connection if user was authenticated
-        if 'user' in locals():
-            user_id_str = str(user.id)
-            if user_id_str in active_connections:
-                del active_connections[user_id_str]
-                print(f"[WebSocket] Removed connection for user: {user_id_str} (exception cleanup)")
-        
+        logger.exception("[WebSocket] Error: %s: %s", type(e).__name__, e)
+        # Auth failed before accept, or the connection broke mid-stream
         try:
             await websocket.close()
-        except:
+        except Exception:
             pass
+    finally:
+        # Let in-flight handlers finish before the writer goes away
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        if writer is not None:
+            writer.cancel()
+        # Remove the connection unless a newer socket for the same user replaced it
+        if queue is not None and active_connections.get(user_id_str) is queue:
+            del active_connections[user_id_str]
 
 async def get_current_user_from_token(token: str, db: Session):
     """Helper function to get user from token for WebSocket"""
@@ -428,7 +482,7 @@ async def get_current_user_from_token(token: str, db: Session):
             payload = verify_token(token)
         except:
             # Fall back to Clerk JWT
-            payload = verify_clerk_jwt(token)
+            payload = await verify_clerk_jwt(token)
         
         # Extract user ID from token
         user_id = payload.get("sub") or payload.get("user_id")
@@ -447,5 +501,5 @@ async def get_current_user_from_token(token: str, db: Session):
     except WebSocketDisconnect:
         raise
     except Exception as e:
-        print(f"WebSocket authentication error: {e}")
+        logger.info("[WebSocket] Authentication error: %s", e)
         raise WebSocketDisconnect(1008, "Authentication failed")
\ No newline at end of file
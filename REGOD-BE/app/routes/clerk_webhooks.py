@@ -1,44 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from sqlalchemy.orm import Session
-import json
-from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, status
+import orjson
 
-from app.database import get_db
-from app.models import User, Role
+from app.clerk import verified_body
+from app.database import get_db_pool
 from app.schemas import ClerkWebhookEvent, ClerkUserCreated
-from app.clerk import clerk_client
 
 router = APIRouter()
 
 @router.post("/clerk-webhook")
 async def clerk_webhook_handler(
-    request: Request,
-    db: Session = Depends(get_db)
+    body: bytes = Depends(verified_body),
+    pool=Depends(get_db_pool)
 ):
     """Handle Clerk webhook events"""
-    # Verify webhook signature
-    signature = request.headers.get("svix-signature")
-    timestamp = request.headers.get("svix-timestamp")
-    
-    if not signature or not timestamp:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Missing webhook signature"
-        )
-    
-    # Get raw body
-    body = await request.body()
-    
-    # Verify signature (implementation depends on your verification method)
-    # if not clerk_client.verify_webhook_signature(body, signature, timestamp):
-    #     raise HTTPException(
-    #         status_code=status.HTTP_401_UNAUTHORIZED,
-    #         detail="Invalid webhook signature"
-    #     )
-    
     # Parse webhook event
     try:
-        event_data = json.loads(body)
+        event_data = orjson.loads(body)
         event = ClerkWebhookEvent(**event_data)
     except Exception as e:
         raise HTTPException(
@@ -48,15 +25,15 @@ async def clerk_webhook_handler(
     
     # Handle different event types
     if event.type == "user.created":
-        await handle_user_created(event.data, db)
+        await handle_user_created(event.data, pool)
     elif event.type == "user.updated":
-        await handle_user_updated(event.data, db)
+        await handle_user_updated(event.data, pool)
     elif event.type == "user.deleted":
-        await handle_user_deleted(event.data, db)
+        await handle_user_deleted(event.data, pool)
     
     return {"status": "success"}
 
-async def handle_user_created(user_data: dict, db: Session):
+async def handle_user_created(user_data: dict, pool):
     """Handle user.created webhook event"""
     try:
         clerk_user = ClerkUserCreated(**user_data)
@@ -66,13 +43,13 @@ async def handle_user_created(user_data: dict, db: Session):
         if not email:
             return
         
-        # Check if user already exists
-        existing_user = db.query(User).filter(User.email == email).first()
-        if existing_user:
-            # Update Clerk user ID if missing
-            if not existing_user.clerk_user_id:
-                existing_user.clerk_user_id = clerk_user.id
-                db.commit()
+        # Link the Clerk user ID to an existing user (only if missing) in one round-trip
+        async with pool.acquire() as conn:
+            user_id = await conn.fetchval(
+                "UPDATE users SET clerk_user_id = COALESCE(clerk_user_id, $2) WHERE email = $1 RETURNING id",
+                email, clerk_user.id
+            )
+        if user_id is not None:
             return
         
         # Only create users if they're coming through teacher signup flow
@@ -91,47 +68,36 @@ async def handle_user_created(user_data: dict, db: Session):
         # Log error but don't break the webhook
         print(f"Error handling user.created event: {str(e)}")
 
-async def handle_user_updated(user_data: dict, db: Session):
+async def handle_user_updated(user_data: dict, pool):
     """Handle user.updated webhook event"""
     try:
         clerk_user = ClerkUserCreated(**user_data)
         
-        # Find user by Clerk ID
-        user = db.query(User).filter(User.clerk_user_id == clerk_user.id).first()
-        if not user:
-            return
-        
-        # Update user details
         email = clerk_user.email_addresses[0].get("email_address") if clerk_user.email_addresses else None
-        if email:
-            user.email = email
-        
         name = f"{clerk_user.first_name or ''} {clerk_user.last_name or ''}".strip() or clerk_user.username
-        if name:
-            user.name = name
         
-        db.commit()
+        # Update user details by Clerk ID, keeping current values for missing fields
+        async with pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE users SET email = COALESCE($2, email), name = COALESCE($3, name) WHERE clerk_user_id = $1",
+                clerk_user.id, email, name or None
+            )
         
     except Exception as e:
         # Log error but don't break the webhook
         print(f"Error handling user.updated event: {str(e)}")
 
-async def handle_user_deleted(user_data: dict, db: Session):
+async def handle_user_deleted(user_data: dict, pool):
     """Handle user.deleted webhook event"""
     try:
         clerk_user_id = user_data.get("id")
         if not clerk_user_id:
             return
         
-        # Find user by Clerk ID
-        user = db.query(User).filter(User.clerk_user_id == clerk_user_id).first()
-        if not user:
-            return
-        
         # Deactivate user instead of deleting to preserve data
-        user.is_active = False
-        db.commit()
+        async with pool.acquire() as conn:
+            await conn.execute("UPDATE users SET is_active = FALSE WHERE clerk_user_id = $1", clerk_user_id)
         
     except Exception as e:
         # Log error but don't break the webhook
-        print(f"Error handling user.deleted event: {str(e)}")
\ No newline at end of file
+        print(f"Error handling user.deleted event: {str(e)}")
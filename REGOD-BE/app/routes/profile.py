@@ -7,8 +7,9 @@ from app.database import get_db
 from app.models import User, UserNote, Course, Module, TeacherAssignment, Role
 from app.schemas import UserResponse, UserProfileUpdate, NoteBase, NoteResponse, ShareCourseResponse, PaginatedResponse
 from app.utils.auth import get_current_user
-from app.rbac import require_permission
+from app.rbac import require_permission, get_role_id
 from app.utils.pagination import paginate, create_paginated_response
+from app.routes.teacher_codes import reassign_students
 
 router = APIRouter()
 
@@ -338,28 +339,19 @@ async def delete_account(
     if is_teacher:
         # If teacher/admin is deleting their account, reassign their students to a default admin
         # First, find the primary admin user (the one with admin role)
-        admin_role = db.query(Role).filter(Role.name == "admin").first()
-        if admin_role:
+        admin_role_id = get_role_id(db, "admin")
+        if admin_role_id is not None:
             # Get the first active admin user (preferably the system admin)
             default_admin = db.query(User).join(User.roles).filter(
-                Role.name == "admin",
+                Role.id == admin_role_id,
                 User.is_active == True,
                 User.id != user_id  # Don't assign to themselves
             ).first()
             
             if default_admin:
                 # Find all active teacher assignments where this user is the teacher
-                teacher_assignments = db.query(TeacherAssignment).filter(
-                    TeacherAssignment.teacher_id == user_id,
-                    TeacherAssignment.active == True
-                ).all()
-                
-                # Reassign all students to the default admin
-                reassigned_count = 0
-                for assignment in teacher_assignments:
-                    assignment.teacher_id = default_admin.id
-                    assignment.assigned_by = default_admin.id
-                    reassigned_count += 1
+                # and reassign all their students to the default admin
+                reassigned_count = reassign_students(db, user_id, default_admin.id)
                 
                 if reassigned_count > 0:
                     print(f"Reassigned {reassigned_count} students from teacher {user.email} to admin {default_admin.email}")
@@ -1,8 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
+from sqlalchemy import exists, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
 from typing import List
-import secrets
-import string
+import logging
 from datetime import datetime, timedelta, timezone
 
 from app.database import get_db
@@ -16,11 +18,86 @@ from app.rbac import require_permission, require_role
 from app.utils.pagination import paginate, create_paginated_response
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-def generate_teacher_code(length=8):
-    """Generate a random teacher code"""
-    alphabet = string.ascii_uppercase + string.digits
-    return ''.join(secrets.choice(alphabet) for _ in range(length))
+# Attempts at a fresh random code before giving up (collisions are rare)
+TEACHER_CODE_ATTEMPTS = 5
+
+def _insert_teacher_code_stmt(values):
+    return (
+        insert(TeacherCode)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=[TeacherCode.code])
+        .returning(TeacherCode)
+    )
+
+def _teacher_code_exhausted() -> HTTPException:
+    # Every attempt colliding means the code space is nearly full (or the
+    # generator is broken), so make it loud rather than just failing the request
+    logger.error("Teacher code generation failed after %d attempts", TEACHER_CODE_ATTEMPTS)
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Could not generate a unique teacher code, please retry"
+    )
+
+def insert_teacher_code(db: Session, **values) -> TeacherCode:
+    """Insert a TeacherCode with a freshly generated code.
+
+    The code comes from the column's server default (gen_teacher_code(), see
+    migrate_teacher_code_default.sql) and is read back via RETURNING.
+    The unique index on code decides collisions: ON CONFLICT DO NOTHING returns
+    no row and we retry with a new code, so there is no separate existence
+    check and no race between checking and inserting.
+    """
+    for _ in range(TEACHER_CODE_ATTEMPTS):
+        teacher_code = db.scalars(_insert_teacher_code_stmt(values)).first()
+        if teacher_code is not None:
+            return teacher_code
+    raise _teacher_code_exhausted()
+
+async def insert_teacher_code_async(db: AsyncSession, **values) -> TeacherCode:
+    """insert_teacher_code for AsyncSession handlers"""
+    for _ in range(TEACHER_CODE_ATTEMPTS):
+        teacher_code = (await db.scalars(_insert_teacher_code_stmt(values))).first()
+        if teacher_code is not None:
+            return teacher_code
+    raise _teacher_code_exhausted()
+
+def reassign_students(db: Session, from_teacher_id, to_teacher_id) -> int:
+    """Move a teacher's active students to another teacher in bulk UPDATEs.
+
+    Students the target teacher already has an assignment for (unique per
+    teacher/student pair) get that assignment reactivated instead, and the
+    source assignment is deactivated. Returns the number of students moved.
+    """
+    existing = aliased(TeacherAssignment)
+    source_students = select(TeacherAssignment.student_id).where(
+        TeacherAssignment.teacher_id == from_teacher_id,
+        TeacherAssignment.active == True
+    )
+    reactivated = db.execute(
+        update(existing)
+        .where(existing.teacher_id == to_teacher_id, existing.student_id.in_(source_students))
+        .values(active=True)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    moved = db.execute(
+        update(TeacherAssignment)
+        .where(
+            TeacherAssignment.teacher_id == from_teacher_id,
+            TeacherAssignment.active == True,
+            ~exists().where(existing.teacher_id == to_teacher_id, existing.student_id == TeacherAssignment.student_id)
+        )
+        .values(teacher_id=to_teacher_id, assigned_by=to_teacher_id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.execute(
+        update(TeacherAssignment)
+        .where(TeacherAssignment.teacher_id == from_teacher_id, TeacherAssignment.active == True)
+        .values(active=False)
+        .execution_options(synchronize_session=False)
+    )
+    return reactivated + moved
 
 @router.post("/teacher-codes", response_model=TeacherCodeResponse)
 @require_role("teacher")
@@ -45,20 +122,13 @@ async def create_teacher_code(
             detail="You can only create codes for yourself"
         )
     
-    # Generate unique code
-    code = generate_teacher_code()
-    while db.query(TeacherCode).filter(TeacherCode.code == code).first():
-        code = generate_teacher_code()
-    
-    # Create teacher code
-    teacher_code = TeacherCode(
-        code=code,
+    # Create teacher code with a unique generated code
+    teacher_code = insert_teacher_code(
+        db,
         teacher_id=code_data.teacher_id,
         max_uses=code_data.max_uses,
         expires_at=code_data.expires_at
     )
-    
-    db.add(teacher_code)
     db.commit()
     db.refresh(teacher_code)
     
@@ -94,9 +164,9 @@ async def get_teacher_codes(
             "code": code.code,
             "teacher_id": str(code.teacher_id),
             "teacher_name": current_user["name"],
-            "created_at": code.created_at.isoformat() if code.created_at else None,
+            "created_at": code.created_at,
             "max_uses": code.max_uses,
-            "expires_at": code.expires_at.isoformat() if code.expires_at else None,
+            "expires_at": code.expires_at,
             "use_count": code.use_count,
             "is_active": code.is_active
         })
@@ -277,7 +347,7 @@ async def get_student_access(
             "student_name": current_user["name"],
             "teacher_id": str(access.teacher_id),
             "teacher_name": teacher.name if teacher else "Unknown Teacher",
-            "granted_at": access.assigned_at.isoformat() if access.assigned_at else None,
+            "granted_at": access.assigned_at,
             "is_active": access.active
         })
     
@@ -1,6 +1,7 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
 from typing import Optional, List, Any, Generic, TypeVar
 from datetime import datetime
+from uuid import UUID
 
 # Generic type for pagination
 T = TypeVar('T')
@@ -16,8 +17,7 @@ class PaginatedResponse(BaseModel, Generic[T]):
     has_next: bool
     has_prev: bool
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Auth Schemas
 class UserBase(BaseModel):
@@ -49,8 +49,7 @@ class UserResponse(UserBase):
     last_login: Optional[datetime] = None
     roles: List[str] = []
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class UserProfileUpdate(BaseModel):
     name: Optional[str] = None
@@ -101,8 +100,7 @@ class RoleResponse(RoleBase):
     created_at: datetime
     permissions: List[str] = []
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class PermissionBase(BaseModel):
     name: str
@@ -112,20 +110,22 @@ class PermissionResponse(PermissionBase):
     id: int
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class UserRoleAssignmentBase(BaseModel):
     user_id: int
     role_id: int
 
+class BulkRoleAssignment(BaseModel):
+    role_id: int
+    user_ids: List[UUID]
+
 class UserRoleAssignmentResponse(UserRoleAssignmentBase):
     id: int
     assigned_by: int
     assigned_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class TeacherAssignmentBase(BaseModel):
     teacher_id: int
@@ -137,8 +137,7 @@ class TeacherAssignmentResponse(TeacherAssignmentBase):
     assigned_at: datetime
     active: bool
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Teacher Code Schemas
 class TeacherCodeBase(BaseModel):
@@ -157,8 +156,20 @@ class TeacherCodeResponse(TeacherCodeBase):
     use_count: int
     is_active: bool
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
+
+class InviteTeacherIn(BaseModel):
+    name: str = Field(min_length=1)
+    email: EmailStr
+    max_uses: int = 1
+    expires_in_days: Optional[int] = None
+    redirect_url: Optional[str] = None
+
+class TeacherSignupIn(BaseModel):
+    email: EmailStr
+    password: str = Field(min_length=1)
+    teacher_code: str = Field(min_length=1)
+    name: Optional[str] = None
 
 class TeacherCodeUseRequest(BaseModel):
     code: str
@@ -177,8 +188,7 @@ class StudentAccessResponse(BaseModel):
     granted_at: datetime
     is_active: bool
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Course Schemas
 class CourseBase(BaseModel):
@@ -194,8 +204,7 @@ class CourseResponse(CourseBase):
     created_by: str
     created_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class ChapterBase(BaseModel):
     title: str
@@ -206,8 +215,7 @@ class ChapterBase(BaseModel):
 class ChapterResponse(ChapterBase):
     id: int
     course_id: int
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class ModuleBase(BaseModel):
     title: str
@@ -261,8 +269,7 @@ class ModuleResponse(ModuleBase):
     id: int
     course_id: int
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class UserCourseProgressBase(BaseModel):
     course_id: int
@@ -277,8 +284,7 @@ class UserCourseProgressResponse(UserCourseProgressBase):
     last_visited_at: datetime
     is_favorite: bool
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Dashboard Schemas
 class DashboardResponse(BaseModel):
@@ -299,8 +305,7 @@ class FavoriteResponse(FavoriteBase):
     course_title: str
     thumbnail_url: Optional[str] = None
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Chat Schemas
 class MessageBase(BaseModel):
@@ -317,8 +322,7 @@ class MessageResponse(MessageBase):
     timestamp: datetime
     read_status: bool
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class ThreadResponse(BaseModel):
     id: int
@@ -332,8 +336,7 @@ class ThreadResponse(BaseModel):
     last_message: Optional[str] = None
     last_message_time: Optional[str] = None
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 # Profile Schemas
 class NoteBase(BaseModel):
@@ -348,8 +351,7 @@ class NoteResponse(NoteBase):
     created_at: datetime
     updated_at: datetime
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class ShareCourseResponse(BaseModel):
     shareable_link: str
@@ -364,8 +366,7 @@ class FavoriteResponse(BaseModel):
     course_title: str
     thumbnail_url: Optional[str] = None
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 class ChapterFavoriteResponse(BaseModel):
     id: int
@@ -380,5 +381,4 @@ class ChapterFavoriteResponse(BaseModel):
     completed_modules: int
     total_modules: int
     
-    class Config:
-        from_attributes = True
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
@@ -6,7 +6,7 @@ from typing import Dict, Any, Optional
 from app.database import get_db
 from app.models import User, Role
 from app.clerk_jwt import verify_clerk_jwt, verify_clerk_session
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 import os
 import logging
 from datetime import datetime, timedelta
@@ -133,7 +133,7 @@ async def get_current_user(
             # Check if token looks like a JWT (has 3 parts separated by dots)
             if token.count('.') == 2:
                 logger.info("Token appears to be a JWT, attempting Clerk JWT verification...")
-                payload = verify_clerk_jwt(token)
+                payload = await verify_clerk_jwt(token)
                 logger.info(f"Successfully verified Clerk JWT token with payload: {payload}")
             else:
                 logger.info("Token does not appear to be a JWT, skipping Clerk JWT verification...")
@@ -189,16 +189,18 @@ async def get_current_user(
             )
         
         # Try to find user by UUID first, then by Clerk user ID, then by email
+        # Roles and their permissions are loaded up front (2 queries, not N+1)
+        user_query = db.query(User).options(selectinload(User.roles).selectinload(Role.permissions))
         try:
             user_uuid = uuid.UUID(user_id)
-            user = db.query(User).filter(User.id == user_uuid).first()
+            user = user_query.filter(User.id == user_uuid).first()
         except ValueError:
             # Not a UUID, try Clerk user ID
-            user = db.query(User).filter(User.clerk_user_id == user_id).first()
+            user = user_query.filter(User.clerk_user_id == user_id).first()
         
         if not user and email:
             # Try to find by email as last resort
-            user = db.query(User).filter(User.email == email).first()
+            user = user_query.filter(User.email == email).first()
         
         # Create user if doesn't exist
         if not user:
@@ -214,7 +216,8 @@ async def get_current_user(
             db.add(user)
             
             # Assign default student role
-            student_role = db.query(Role).filter(Role.name == "student").first()
+            from app.rbac import get_role  # app.rbac imports this module
+            student_role = get_role(db, "student")
             if student_role:
                 user.roles.append(student_role)
             
@@ -280,7 +283,7 @@ async def get_current_user(
             "clerk_user_id": user.clerk_user_id,  # Store Clerk ID for reference
             "avatar_url": user.avatar_url,  # Include avatar URL from database
             "roles": roles,  # Include all roles for permission checking
-            "permissions": [perm.name for role in user.roles for perm in role.permissions]  # Include all permissions
+            "permissions": list(user._perm_set)  # Include all permissions
         }
         
     except HTTPException:
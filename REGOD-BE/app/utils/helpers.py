@@ -1,6 +1,40 @@
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional
-import json
+import asyncio
+import orjson
+import logging
+import logging.handlers
+import os
+import queue
+
+# UTC ISO timestamp refreshed by tick_current_ts every 100ms, for response
+# timestamps that don't need to be exact. Read as helpers.CURRENT_TS.
+CURRENT_TS = datetime.utcnow().isoformat()
+
+async def tick_current_ts(interval: float = 0.1):
+    """Keep CURRENT_TS up to date (run as a background task)"""
+    global CURRENT_TS
+    while True:
+        CURRENT_TS = datetime.utcnow().isoformat()
+        await asyncio.sleep(interval)
+
+def configure_logging() -> logging.handlers.QueueListener:
+    """
+    Route all logging through a QueueHandler so the event loop only enqueues
+    records; a listener thread does the actual writes to stderr.
+    Level comes from LOG_LEVEL (default INFO, so per-message DEBUG logs are dropped
+    before any formatting). Returns the started listener; stop() it on shutdown.
+    """
+    log_queue = queue.SimpleQueue()
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    listener.start()
+    return listener
 
 def format_timestamp(dt: datetime) -> str:
     """Format datetime to ISO string"""
@@ -43,8 +77,8 @@ def calculate_pagination_metadata(total_items: int, page: int, page_size: int):
 def safe_json_loads(json_str: str, default=None):
     """Safely parse JSON string"""
     try:
-        return json.loads(json_str)
-    except (json.JSONDecodeError, TypeError):
+        return orjson.loads(json_str)
+    except (orjson.JSONDecodeError, TypeError):
         return default
 
 def validate_email(email: str) -> bool:
@@ -1,8 +1,14 @@
 """
 Pagination utility for consistent pagination across all endpoints
 """
-from typing import TypeVar, Generic, List, Optional
-from pydantic import BaseModel
+from typing import TypeVar, Generic, List, Optional, Tuple
+from datetime import datetime
+from uuid import UUID
+import base64
+import binascii
+import orjson
+from fastapi import HTTPException, status
+from pydantic import BaseModel, ConfigDict
 from sqlalchemy.orm import Query
 
 T = TypeVar('T')
@@ -33,8 +39,7 @@ class PaginatedResponse(BaseModel, Generic[T]):
     has_next: bool
     has_prev: bool
     
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 def paginate(
@@ -109,3 +114,25 @@ def create_paginated_response(
         "has_prev": has_prev
     }
 
+
+
+def encode_cursor(created_at: datetime, row_id: UUID) -> str:
+    """
+    Encode a (created_at, id) keyset position as an opaque URL-safe cursor
+    """
+    raw = orjson.dumps([created_at.isoformat(), str(row_id)])
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """
+    Decode a cursor produced by encode_cursor
+    
+    Raises:
+        HTTPException 400 if the cursor is malformed
+    """
+    try:
+        created_at, row_id = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), UUID(row_id)
+    except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
@@ -1,4 +1,6 @@
+import hmac
 import secrets
+import socket
 import string
 from passlib.context import CryptContext
 
@@ -13,10 +15,56 @@ def generate_secure_token(length=32):
     """Generate a cryptographically secure token"""
     return secrets.token_urlsafe(length)
 
+# Bodies at least this large are HMACed by the kernel crypto API when available
+AF_ALG_MIN_SIZE = 64 * 1024
+
+def _af_alg_hmac_sha256(key: bytes):
+    """Return a kernel (AF_ALG) HMAC-SHA256 socket bound to ``key``, or None if unsupported."""
+    if not key or not hasattr(socket, "AF_ALG"):
+        return None
+    try:
+        sock = socket.socket(socket.AF_ALG, socket.SOCK_SEQPACKET, 0)
+    except OSError:
+        return None
+    try:
+        sock.bind(("hash", "hmac(sha256)"))
+        sock.setsockopt(socket.SOL_ALG, socket.ALG_SET_KEY, key)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+def hmac_sha256_verifier(key: bytes):
+    """Return a ``verify(message, signature)`` function for a fixed HMAC-SHA256 key.
+
+    The ipad/opad key blocks are hashed once here; each call clones that
+    keyed state instead of re-deriving it from the key. Large messages go
+    through the kernel's hmac(sha256) over AF_ALG when the platform has it.
+    """
+    seed = hmac.new(key, digestmod="sha256")
+    alg_sock = _af_alg_hmac_sha256(key)
+
+    def verify(message: bytes, signature: bytes) -> bool:
+        if alg_sock is not None and len(message) >= AF_ALG_MIN_SIZE:
+            try:
+                op, _ = alg_sock.accept()
+                with op:
+                    # MSG_MORE keeps the hash open across partial sends; recv finalizes it
+                    op.sendall(message, socket.MSG_MORE)
+                    digest = op.recv(32)
+                return hmac.compare_digest(digest, signature)
+            except OSError:
+                pass
+        mac = seed.copy()
+        mac.update(message)
+        return hmac.compare_digest(mac.digest(), signature)
+
+    return verify
+
 def verify_password(plain_password, hashed_password):
     """Verify a password against a hash"""
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     """Hash a password"""
-    return pwd_context.hash(password)
\ No newline at end of file
+    return pwd_context.hash(password)
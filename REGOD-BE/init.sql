@@ -1,6 +1,17 @@
 -- Create extensions (pgmq includes necessary dependencies)
 CREATE EXTENSION IF NOT EXISTS "uuid-ossp";
 CREATE EXTENSION IF NOT EXISTS "pgmq" CASCADE;
+CREATE EXTENSION IF NOT EXISTS pgcrypto;
+
+-- Server-side default for teacher_codes.code (tables are created later by the app)
+CREATE OR REPLACE FUNCTION gen_teacher_code(len integer DEFAULT 8) RETURNS text
+LANGUAGE sql VOLATILE AS $$
+    SELECT string_agg(
+        substr('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789',
+               (((get_byte(r.b, 2 * i) << 8) | get_byte(r.b, 2 * i + 1)) % 36) + 1, 1),
+        '' ORDER BY i)
+    FROM (SELECT gen_random_bytes(2 * len) AS b) r, generate_series(0, len - 1) AS i
+$$;
 
 -- Create PGMQ queues for chat notifications
 SELECT pgmq.create('chat_notifications');
@@ -0,0 +1,15 @@
+-- Migration script adding a NOTIFY when chat thread membership changes
+-- The realtime connection manager caches thread members and listens on
+-- chat_thread_change to drop stale entries.
+
+CREATE OR REPLACE FUNCTION notify_chat_thread_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('chat_thread_change', OLD.id::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS chat_thread_change ON chat_threads;
+CREATE TRIGGER chat_thread_change
+    AFTER UPDATE OF user_id, assigned_teacher_id OR DELETE ON chat_threads
+    FOR EACH ROW EXECUTE FUNCTION notify_chat_thread_change();
@@ -0,0 +1,35 @@
+-- Migration script adding composite indexes for hot query paths
+-- create_all only builds indexes for new tables, so run this against existing databases.
+-- CONCURRENTLY avoids locking writes; run each statement outside a transaction block.
+
+-- Progress lookups by (user, course) and (user, module)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_course_progress_user_course
+    ON user_course_progress (user_id, course_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_module_progress_user_module
+    ON user_module_progress (user_id, module_id) INCLUDE (status);
+
+-- Chat history: messages in a thread ordered by timestamp
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_chat_messages_thread_ts
+    ON chat_messages (thread_id, timestamp) INCLUDE (sender_id, read_status);
+
+-- user_favorites (user_id, lesson_id) is already covered by unique_user_lesson_favorite
+
+-- JSONB containment (@>) lookups into module quiz and key verse content
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_modules_quiz_gin
+    ON modules USING gin (quiz jsonb_path_ops);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_modules_key_verses_json_gin
+    ON modules USING gin (key_verses_json jsonb_path_ops);
+
+-- Role directory and count queries: filter user_roles by role, join back to users
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_roles_role_user
+    ON user_roles (role_id, user_id);
+
+-- Keyset pagination of the admin user listing on (created_at, id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_created_at_id
+    ON users (created_at, id);
+
+-- Per-user role checks (EXISTS / NOT EXISTS on user_roles.user_id)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_roles_user_role
+    ON user_roles (user_id, role_id);
@@ -0,0 +1,21 @@
+-- Migration script adding a unique (teacher_id, student_id) constraint to teacher_assignments
+-- create_teacher_assignment upserts with ON CONFLICT (teacher_id, student_id), which needs it.
+
+BEGIN;
+
+-- Collapse duplicate pairs, keeping an active row if there is one (then the oldest)
+DELETE FROM teacher_assignments ta
+USING (
+    SELECT id,
+           row_number() OVER (
+               PARTITION BY teacher_id, student_id
+               ORDER BY active DESC NULLS LAST, id
+           ) AS rn
+    FROM teacher_assignments
+) dup
+WHERE ta.id = dup.id AND dup.rn > 1;
+
+ALTER TABLE teacher_assignments
+    ADD CONSTRAINT unique_teacher_student_assignment UNIQUE (teacher_id, student_id);
+
+COMMIT;
@@ -0,0 +1,17 @@
+-- Migration script moving teacher code generation into the database
+-- teacher_codes.code defaults to gen_teacher_code(); inserts read the code back
+-- with RETURNING. Codes are 8 characters from A-Z and 0-9.
+
+CREATE EXTENSION IF NOT EXISTS pgcrypto;
+
+-- Two random bytes per character keep the modulo-36 bias negligible
+CREATE OR REPLACE FUNCTION gen_teacher_code(len integer DEFAULT 8) RETURNS text
+LANGUAGE sql VOLATILE AS $$
+    SELECT string_agg(
+        substr('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789',
+               (((get_byte(r.b, 2 * i) << 8) | get_byte(r.b, 2 * i + 1)) % 36) + 1, 1),
+        '' ORDER BY i)
+    FROM (SELECT gen_random_bytes(2 * len) AS b) r, generate_series(0, len - 1) AS i
+$$;
+
+ALTER TABLE teacher_codes ALTER COLUMN code SET DEFAULT gen_teacher_code();
@@ -0,0 +1,113 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import importlib
+import importlib.util
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import app.clerk as clerk
+from app.utils.security import hmac_sha256_verifier
+
+WEBHOOK_KEY = b"test-webhook-secret"
+
+
+def _sign(svix_id: str, timestamp: str, body: bytes, key: bytes = WEBHOOK_KEY) -> str:
+    digest = hmac.new(key, f"{svix_id}.{timestamp}.".encode() + body, hashlib.sha256).digest()
+    return "v1," + base64.b64encode(digest).decode()
+
+
+class _Request:
+    def __init__(self, body: bytes):
+        self._body = body
+
+    async def body(self) -> bytes:
+        return self._body
+
+
+@pytest.fixture(autouse=True)
+def webhook_secret(monkeypatch):
+    monkeypatch.setattr(clerk, "_verify_signature", hmac_sha256_verifier(WEBHOOK_KEY))
+    clerk._verify_cache.clear()
+    yield
+    clerk._verify_cache.clear()
+
+
+def test_svix_signature_accepted():
+    body = b'{"type":"user.created"}'
+    assert clerk._verify_svix("msg_1", "1700000000", _sign("msg_1", "1700000000", body), body)
+
+
+def test_svix_signature_accepted_among_several():
+    body = b'{"type":"user.created"}'
+    signature = "v1,AAAA " + _sign("msg_1", "1700000000", body)
+    assert clerk._verify_svix("msg_1", "1700000000", signature, body)
+
+
+@pytest.mark.parametrize("signature", [
+    _sign("msg_1", "1700000000", b'{"type":"user.deleted"}'),  # different body
+    _sign("msg_1", "1700000000", b'{"type":"user.created"}', key=b"other-secret"),
+    _sign("msg_2", "1700000000", b'{"type":"user.created"}'),  # different svix-id
+    "v2," + _sign("msg_1", "1700000000", b'{"type":"user.created"}')[3:],  # unknown version
+    "v1,not-base64!",
+    "",
+])
+def test_svix_signature_rejected(signature):
+    assert not clerk._verify_svix("msg_1", "1700000000", signature, b'{"type":"user.created"}')
+
+
+def test_verify_cache_evicts_oldest_at_size_cap(monkeypatch):
+    calls = []
+
+    def fake_verify(svix_id, timestamp, signature, body):
+        calls.append(svix_id)
+        return True
+
+    monkeypatch.setattr(clerk, "_verify_svix", fake_verify)
+    for i in range(clerk.VERIFY_CACHE_SIZE + 1):
+        clerk._verify_cached(f"msg_{i}", "1700000000", "v1,sig", b"{}")
+
+    assert clerk.VERIFY_CACHE_SIZE == 4096
+    assert len(clerk._verify_cache) == clerk.VERIFY_CACHE_SIZE
+    # The oldest entry was evicted, so verifying it again misses the cache
+    clerk._verify_cached("msg_0", "1700000000", "v1,sig", b"{}")
+    assert calls.count("msg_0") == 2
+    # A recent entry is still served from the cache
+    clerk._verify_cached(f"msg_{clerk.VERIFY_CACHE_SIZE}", "1700000000", "v1,sig", b"{}")
+    assert calls.count(f"msg_{clerk.VERIFY_CACHE_SIZE}") == 1
+
+
+def test_verified_body_accepts_fresh_delivery():
+    body = b'{"type":"user.created"}'
+    timestamp = str(int(time.time()))
+    result = asyncio.run(clerk.verified_body(_Request(body), "msg_1", timestamp, _sign("msg_1", timestamp, body)))
+    assert result == body
+
+
+@pytest.mark.parametrize("timestamp", [
+    str(int(time.time()) - clerk.WEBHOOK_TOLERANCE_SECONDS - 60),
+    str(int(time.time()) + clerk.WEBHOOK_TOLERANCE_SECONDS + 60),
+    "not-a-timestamp",
+])
+def test_verified_body_rejects_stale_or_bad_timestamp(timestamp):
+    body = b'{"type":"user.created"}'
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(clerk.verified_body(_Request(body), "msg_1", timestamp, _sign("msg_1", timestamp, body)))
+    assert exc.value.status_code == 401
+
+
+def test_single_clerk_module():
+    assert importlib.util.find_spec("app.auth") is None
+    assert importlib.util.find_spec("app.clerk").origin == clerk.__file__
+
+
+def test_clerk_client_is_shared():
+    client_id = id(clerk.clerk_client)
+    assert id(importlib.import_module("app.clerk").clerk_client) == client_id
+
+    from app.routes import admin, auth
+    assert auth.clerk_client is clerk.clerk_client
+    assert admin.clerk_client is clerk.clerk_client
@@ -1597,8 +1597,9 @@ class ApiService {
       wsBaseUrl = `ws://${wsBaseUrl}`;
     }
 
-    // Use the correct WebSocket endpoint with token as query parameter
-    const wsUrl = `${wsBaseUrl}/connect/socket?token=${encodeURIComponent(token)}`;
+    // Use the correct WebSocket endpoint with token as query parameter;
+    // batch=1 opts in to JSON array frames for bursts (see handleWebSocketMessage)
+    const wsUrl = `${wsBaseUrl}/connect/socket?token=${encodeURIComponent(token)}&batch=1`;
     console.log('[WebSocket] Attempting connection to:', wsUrl.replace(token, 'TOKEN_HIDDEN'));
 
     try {
@@ -1616,12 +1617,16 @@ class ApiService {
     onError: (error: any) => void
   ) {
     try {
-      const data = JSON.parse(message);
+      const parsed = JSON.parse(message);
+      // The server coalesces bursts of events into a single JSON array frame
+      const events = Array.isArray(parsed) ? parsed : [parsed];
       
-      if (data.type === 'new_message') {
-        onNewMessage(data.message);
-      } else if (data.type === 'error') {
-        onError(data.error);
+      for (const data of events) {
+        if (data.type === 'new_message') {
+          onNewMessage(data.message);
+        } else if (data.type === 'error') {
+          onError(data.error);
+        }
       }
     } catch (error) {
       onError(error);